@@ -0,0 +1,174 @@
+import json
+import os
+import numpy as np
+import torch
+from .q_network import Transition
+
+'''
+On-disk transition archive: fixed-width records in append-only chunk files (chunk_<n>.bin) and index.json
+with the number of records of every chunk. Only what the index counts is read, so an archive can be loaded
+while it is still being written.
+'''
+
+RECORD = np.dtype([
+    ("state", np.float32, 7),
+    ("next_state", np.float32, 7),
+    ("reward", np.float32),
+    ("done", np.bool_),
+])
+
+
+class TransitionArchive:
+    '''
+    Appends transitions to the archive in directory (adding to what is there), buffered in flush_every
+    records, a new chunk file is started every chunk_size records.
+    '''
+    def __init__(self, directory, chunk_size=1_000_000, flush_every=4096):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.buffer = np.zeros(flush_every, dtype=RECORD)
+        self.buffered = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.chunks = read_index(directory)
+        if not self.chunks or self.chunks[-1][1] >= chunk_size:
+            self._new_chunk()
+        else:
+            self._truncate_last()
+
+    def __len__(self):
+        return sum(count for _, count in self.chunks) + self.buffered
+
+    def append(self, state, next_state, reward, done):
+        record = self.buffer[self.buffered]
+        record["state"] = state
+        record["next_state"] = next_state
+        record["reward"] = reward
+        record["done"] = done
+        self.buffered += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def append_many(self, states, next_states, rewards, dones):
+        if len(states) >= len(self.buffer):
+            # larger than the buffer: written right away with what is buffered, still one index write
+            records = np.zeros(self.buffered + len(states), dtype=RECORD)
+            records[:self.buffered] = self.buffer[:self.buffered]
+            self._fill(records[self.buffered:], states, next_states, rewards, dones)
+            self.buffered = 0
+            self._write(records)
+            return
+
+        start = 0
+        while start < len(states):
+            count = min(len(states) - start, len(self.buffer) - self.buffered)
+            end = start + count
+            self._fill(self.buffer[self.buffered:self.buffered + count],
+                       states[start:end], next_states[start:end], rewards[start:end], dones[start:end])
+            self.buffered += count
+            start = end
+            if self.buffered == len(self.buffer):
+                self.flush()
+
+    @staticmethod
+    def _fill(records, states, next_states, rewards, dones):
+        records["state"] = states
+        records["next_state"] = next_states
+        records["reward"] = rewards
+        records["done"] = dones
+
+    def flush(self):
+        if self.buffered:
+            self._write(self.buffer[:self.buffered])
+            self.buffered = 0
+
+    def close(self):
+        self.flush()
+
+    def _write(self, records):
+        while len(records):
+            name, count = self.chunks[-1]
+            if count >= self.chunk_size:
+                self._new_chunk()
+                continue
+
+            part = records[:self.chunk_size - count]
+            with open(os.path.join(self.directory, name), "ab") as f:
+                f.write(part.tobytes())
+            self.chunks[-1][1] += len(part)
+            records = records[len(part):]
+
+        self._write_index()
+
+    def _new_chunk(self):
+        self.chunks.append([_chunk_name(len(self.chunks)), 0])
+        self._truncate_last()
+
+    def _truncate_last(self):
+        # a crash between writing a chunk and the index leaves records the index does not count (maybe
+        # a partial one) at its end, the next ones must go right after the counted ones
+        name, count = self.chunks[-1]
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path) and os.path.getsize(path) != count * RECORD.itemsize:
+            os.truncate(path, count * RECORD.itemsize)
+
+    def _write_index(self):
+        path = os.path.join(self.directory, "index.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"record": RECORD.descr, "chunks": self.chunks}, f)
+        os.replace(path + ".tmp", path)
+
+
+def _chunk_name(number):
+    return f"chunk_{number:05d}.bin"
+
+
+def read_index(directory):
+    path = os.path.join(directory, "index.json")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)["chunks"]
+
+
+class ArchiveLoader:
+    '''
+    Shuffled minibatches (Transitions of tensors, like ReplayMemory.sample) over a whole archive, one epoch
+    per iteration. The chunks are memory mapped and read in blocks of block_size records in random order,
+    mix blocks at a time are shuffled together, so the disk only sees large sequential reads.
+    '''
+    def __init__(self, directory, batch_size=512, device="cpu", block_size=65_536, mix=4, seed=None):
+        self.batch_size = batch_size
+        self.device = device
+        self.block_size = block_size
+        self.mix = mix
+        self.rng = np.random.default_rng(seed)
+
+        self.chunks = [
+            np.memmap(os.path.join(directory, name), dtype=RECORD, mode="r", shape=(count,))
+            for name, count in read_index(directory) if count
+        ]
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def __iter__(self):
+        blocks = [(chunk, start) for chunk in range(len(self.chunks)) for start in range(0, len(self.chunks[chunk]), self.block_size)]
+        order = self.rng.permutation(len(blocks))
+
+        for first in range(0, len(order), self.mix):
+            records = np.concatenate([
+                self.chunks[blocks[block][0]][blocks[block][1]:blocks[block][1] + self.block_size]
+                for block in order[first:first + self.mix]
+            ])
+            records = records[self.rng.permutation(len(records))]
+            for start in range(0, len(records) - self.batch_size + 1, self.batch_size):
+                yield self._batch(records[start:start + self.batch_size])
+
+    def _batch(self, records):
+        return Transition(
+            torch.from_numpy(records["state"].copy()).to(self.device),
+            torch.from_numpy(records["next_state"].copy()).to(self.device),
+            torch.from_numpy(records["reward"].copy()).to(self.device),
+            torch.from_numpy(records["done"].copy()).to(self.device),
+        )
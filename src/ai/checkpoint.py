@@ -0,0 +1,117 @@
+import io
+import os
+import random
+import threading
+import numpy as np
+import torch
+
+
+class AsyncSaver:
+    '''
+    Writes files on a background thread, each one to <path>.tmp first and then renamed over path,
+    so a crash never leaves a half written file. A save of a path that is still waiting its turn
+    is replaced by the newer one instead of being written twice.
+    '''
+    def __init__(self):
+        self.pending = {} # path: (write, obj), in submission order
+        self.busy = False
+        self.error = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self.thread.start()
+
+    def save(self, obj, path, write=torch.save):
+        '''
+        Queues write(obj, file). obj must not change afterwards, callers pass copies.
+        '''
+        with self.condition:
+            self._raise_error()
+            self.pending.pop(path, None)
+            self.pending[path] = (write, obj)
+            self.condition.notify_all()
+
+    def wait(self):
+        with self.condition:
+            self.condition.wait_for(lambda: not self.pending and not self.busy)
+            self._raise_error()
+
+    def close(self):
+        self.wait()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.closed)
+                if not self.pending:
+                    return
+                path = next(iter(self.pending))
+                write, obj = self.pending.pop(path)
+                self.busy = True
+
+            try:
+                temporary = path + ".tmp"
+                write(obj, temporary)
+                os.replace(temporary, path)
+            except Exception as error:
+                self.error = error
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+
+def rng_states():
+    states = {
+        "random": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        states["cuda"] = torch.cuda.get_rng_state_all()
+    return states
+
+
+def set_rng_states(states):
+    random.setstate(states["random"])
+    np.random.set_state(states["numpy"])
+    torch.set_rng_state(states["torch"])
+    if "cuda" in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states["cuda"])
+
+
+def write_checkpoint(state, path):
+    '''
+    torch.save of a training state, the arrays of its "replay" entry (a ReplayMemory.state_dict())
+    are stored as one compressed npz blob.
+    '''
+    replay = state.get("replay")
+    if replay is not None:
+        arrays = {key: value for key, value in replay.items() if isinstance(value, np.ndarray)}
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        replay = {key: value for key, value in replay.items() if key not in arrays}
+        replay["arrays"] = buffer.getvalue()
+        state = dict(state, replay=replay)
+
+    torch.save(state, path)
+
+
+def load_checkpoint(path, device="cpu"):
+    state = torch.load(path, map_location=device, weights_only=False)
+
+    replay = state.get("replay")
+    if replay is not None:
+        with np.load(io.BytesIO(replay.pop("arrays"))) as arrays:
+            replay.update({key: arrays[key] for key in arrays.files})
+
+    return state
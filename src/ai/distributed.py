@@ -0,0 +1,133 @@
+from .q_network import QNetworkA
+import torch
+import torch.multiprocessing as mp
+import random
+import queue
+import time
+
+
+def run_actor(worker, engine, shared_network, epsilon, version, transitions, stop):
+    '''
+    Plays episodes on its own game with a local copy of the learner's network and sends every finished
+    episode as (worker, [(state, next_state, reward, done), ...], rewards) on the transitions queue.
+    The local network is refreshed whenever the learner bumps version.
+    '''
+    random.seed()
+    torch.set_num_threads(1)
+
+    env = engine()
+    network = QNetworkA()
+    seen_version = _load_weights(network, shared_network, version)
+    network.eval()
+
+    while not stop.is_set():
+        if version.value != seen_version:
+            seen_version = _load_weights(network, shared_network, version)
+
+        state = env.reset()
+        episode = []
+        rewards = 0
+        while not env.done:
+            candidates = env.prepare_candidates()
+            if random.uniform(0, 1) < epsilon.value:
+                best = random.randrange(len(candidates))
+            else:
+                with torch.no_grad():
+                    values = network(torch.from_numpy(candidates.features))
+                    best = values.argmax().item()
+
+            observation, reward, done = env.play_candidate(best)
+            episode.append((state, None if done else observation, reward, done))
+            rewards += reward
+            state = observation
+
+        # a full queue means the learner is behind, wait for it unless we are asked to stop
+        while not stop.is_set():
+            try:
+                transitions.put((worker, episode, rewards), timeout=0.5)
+                break
+            except queue.Full:
+                pass
+
+
+def _load_weights(network, shared_network, version):
+    # seqlock read: version is odd while publish() writes, a copy that overlapped a write is made again.
+    # Returns the version that was loaded
+    while True:
+        before = version.value
+        if before % 2 == 0:
+            network.load_state_dict(shared_network.state_dict())
+            if version.value == before:
+                return before
+        time.sleep(0.001)
+
+
+class ActorPool:
+    '''
+    N actor processes feeding a single learner. The learner owns the real network and publishes its
+    weights to a shared memory copy with publish(), the actors pick them up on their next episode.
+    '''
+    def __init__(self, workers, engine, network, epsilon):
+        self.context = mp.get_context("spawn")
+
+        self.shared_network = QNetworkA()
+        self.shared_network.load_state_dict({key: value.cpu() for key, value in network.state_dict().items()})
+        self.shared_network.share_memory()
+
+        self.epsilon = self.context.Value('d', epsilon)
+        self.version = self.context.Value('i', 0)
+        self.stop = self.context.Event()
+        self.transitions = self.context.Queue(maxsize=4 * workers)
+
+        self.processes = [
+            self.context.Process(
+                target=run_actor,
+                args=(worker, engine, self.shared_network, self.epsilon, self.version, self.transitions, self.stop),
+                daemon=True,
+            )
+            for worker in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+    def publish(self, network, epsilon):
+        # version is odd while the weights are being written, see _load_weights
+        with self.version.get_lock():
+            self.version.value += 1
+        with torch.no_grad():
+            for key, value in network.state_dict().items():
+                self.shared_network.state_dict()[key].copy_(value)
+        with self.version.get_lock():
+            self.version.value += 1
+        self.epsilon.value = epsilon
+
+    def set_epsilon(self, epsilon):
+        self.epsilon.value = epsilon
+
+    def next_episode(self, timeout=1.0):
+        # actors only stop when asked to, one that exited before that has failed
+        while True:
+            self._check_actors()
+            try:
+                return self.transitions.get(timeout=timeout)
+            except queue.Empty:
+                pass
+
+    def _check_actors(self):
+        for worker, process in enumerate(self.processes):
+            if process.exitcode is not None:
+                raise RuntimeError(f"actor {worker} exited with code {process.exitcode}")
+
+    def close(self):
+        self.stop.set()
+        # drain so no actor is stuck on a full queue
+        try:
+            while True:
+                self.transitions.get_nowait()
+        except queue.Empty:
+            pass
+
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,151 @@
+import os
+import time
+import numpy as np
+
+'''
+Training metrics are streamed to one append-only file of float32 values per series (<directory>/<name>.f32),
+so they survive a crash and can be plotted while training runs, and only the last `window` values of
+every series stay in memory for the running aggregates.
+'''
+
+SERIES = ("loss", "reward", "steps")
+
+
+class RunningStats:
+    '''
+    Aggregates of a series: min, max and count of everything seen, mean and percentiles of the last
+    `size` values, kept in a fixed size ring buffer.
+    '''
+    def __init__(self, size=1000):
+        self.values = np.zeros(size, dtype=np.float64)
+        self.position = 0
+        self.filled = 0
+
+        self.count = 0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def add(self, value):
+        self.values[self.position] = value
+        self.position = (self.position + 1) % len(self.values)
+        self.filled = min(self.filled + 1, len(self.values))
+
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def state_dict(self):
+        return {
+            "values": self.values.copy(),
+            "position": self.position,
+            "filled": self.filled,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    def load_state_dict(self, state):
+        self.values = state["values"].copy()
+        self.position = state["position"]
+        self.filled = state["filled"]
+        self.count = state["count"]
+        self.min = state["min"]
+        self.max = state["max"]
+
+    def window(self):
+        return self.values[:self.filled]
+
+    def summary(self):
+        if self.count == 0:
+            return {"count": 0}
+
+        p10, p50, p90 = np.percentile(self.window(), (10, 50, 90))
+        return {
+            "count": self.count,
+            "mean": float(self.window().mean()),
+            "min": self.min,
+            "max": self.max,
+            "p10": float(p10),
+            "p50": float(p50),
+            "p90": float(p90),
+        }
+
+
+class SeriesLog:
+    '''
+    Append-only float32 file, written in batches of flush_every values or every flush_seconds.
+    Without append the file is started over.
+    '''
+    def __init__(self, path, append=False, flush_every=1024, flush_seconds=10.0):
+        self.path = path
+        if not append:
+            open(path, "wb").close()
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def append(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+
+        with open(self.path, "ab") as f:
+            f.write(np.array(self.buffer, dtype=np.float32).tobytes())
+        self.buffer.clear()
+
+    def truncate(self, count):
+        # drops what was written after the first count values, e.g. by a run that is being resumed
+        self.buffer.clear()
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 4 * count:
+            os.truncate(self.path, 4 * count)
+
+
+def read_series(path):
+    '''
+    The values of a series file, memory mapped so even very long series are cheap to open.
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="r")
+
+
+class Metrics:
+    '''
+    The loss, reward and steps series of a training. directory=None keeps only the running aggregates.
+    '''
+    def __init__(self, directory="metrics", window=1000, append=False):
+        self.directory = directory
+        self.stats = {name: RunningStats(window) for name in SERIES}
+        self.logs = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.logs = {name: SeriesLog(os.path.join(directory, name + ".f32"), append) for name in SERIES}
+
+    def add(self, name, value):
+        self.stats[name].add(value)
+        if self.logs:
+            self.logs[name].append(value)
+
+    def flush(self):
+        for log in self.logs.values():
+            log.flush()
+
+    def state_dict(self):
+        # flushed first, so the logs hold at least what the state counts
+        self.flush()
+        return {name: stats.state_dict() for name, stats in self.stats.items()}
+
+    def load_state_dict(self, state):
+        for name, stats in self.stats.items():
+            stats.load_state_dict(state[name])
+            if self.logs:
+                self.logs[name].truncate(stats.count)
+
+    def summary(self):
+        return {name: stats.summary() for name, stats in self.stats.items()}
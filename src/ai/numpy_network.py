@@ -0,0 +1,109 @@
+import numpy as np
+import random
+
+'''
+Inference for QNetworkA / QNetworkB without torch, from weights exported to a .npz file:
+w0, b0, w1, b1, ... with every weight stored as (in, out), and s<i> per output scales for int8 weights.
+'''
+
+DTYPES = ("float32", "float16", "int8")
+
+
+def export_arrays(state_dict, dtype="float32"):
+    '''
+    The linear layers of a QNetwork state_dict (in layer order) as the arrays of the .npz format.
+    dtype float16 or int8 makes them smaller, the weights are expanded to float32 again when loaded.
+    '''
+    weights = [value for key, value in state_dict.items() if key.endswith("weight")]
+    biases = [value for key, value in state_dict.items() if key.endswith("bias")]
+
+    arrays = {}
+    for i, (weight, bias) in enumerate(zip(weights, biases)):
+        weight = weight.detach().cpu().numpy().T.astype(np.float32)
+        if dtype == "int8":
+            scale = np.abs(weight).max(axis=0) / 127
+            scale[scale == 0] = 1
+            arrays[f"w{i}"] = np.round(weight / scale).astype(np.int8)
+            arrays[f"s{i}"] = scale.astype(np.float32)
+        else:
+            arrays[f"w{i}"] = weight.astype(dtype)
+        arrays[f"b{i}"] = bias.detach().cpu().numpy().astype(np.float32)
+
+    return arrays
+
+
+def export_npz(state_dict, path, dtype="float32"):
+    # export_arrays saved to path
+    np.savez(path, **export_arrays(state_dict, dtype))
+
+
+class NumpyNetwork:
+    '''
+    The exported MLP: ReLU after every layer but the last, with the output buffers of every layer
+    allocated once and reused, so a forward pass is one matmul + add + max per layer.
+    weights is the path of an .npz file or the dict export_arrays returns.
+    '''
+    def __init__(self, weights):
+        data = np.load(weights) if isinstance(weights, str) else weights
+        self.layers = []
+        i = 0
+        while f"w{i}" in data:
+            weight = data[f"w{i}"]
+            if weight.dtype == np.int8:
+                weight = weight.astype(np.float32) * data[f"s{i}"]
+            self.layers.append((np.ascontiguousarray(weight, dtype=np.float32), data[f"b{i}"].astype(np.float32)))
+            i += 1
+
+        self._allocate(64)
+
+    def _allocate(self, rows):
+        self.buffers = [np.empty((rows, weight.shape[1]), dtype=np.float32) for weight, _ in self.layers]
+
+    def __call__(self, x):
+        '''
+        Values of an (n, 7) batch of states as an (n,) array. It is a view of an internal buffer,
+        so it is only valid until the next call.
+        '''
+        x = np.asarray(x, dtype=np.float32)
+        rows = len(x)
+        if rows > len(self.buffers[0]):
+            self._allocate(max(rows, 2 * len(self.buffers[0])))
+
+        last = len(self.layers) - 1
+        for i, (weight, bias) in enumerate(self.layers):
+            out = self.buffers[i][:rows]
+            np.matmul(x, weight, out=out)
+            out += bias
+            if i != last:
+                np.maximum(out, 0, out=out)
+            x = out
+
+        return x[:, 0]
+
+
+class NumpyPolicy:
+    '''
+    Picks moves for env like TetrisNetwork.pick_move, with a fixed epsilon and no training.
+    '''
+    def __init__(self, env, weights="network.npz", epsilon=0.0):
+        self.env = env
+        self.network = NumpyNetwork(weights)
+        self.epsilon = epsilon
+
+    def select_action(self, candidates):
+        if random.uniform(0, 1) < self.epsilon:
+            return random.randrange(len(candidates))
+
+        values = self.network(candidates.features)
+        return int(values.argmax())
+
+    def pick_move(self):
+        candidates = self.env.prepare_candidates()
+
+        best_action = self.select_action(candidates)
+        action = candidates[best_action]
+        return action
+
+    def lookahead_move(self, beam=None):
+        # pick_move with a two ply search over the falling and the next piece, without exploration
+        return self.env.lookahead_move(self.network, beam)
@@ -0,0 +1,54 @@
+import os
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from .metrics import read_series
+
+# series: (file, title, x label, y label)
+GRAPHS = {
+    "loss": ("loss.png", "Training Loss", "Optimization Step", "Loss"),
+    "reward": ("rewards.png", "Episode Reward", "Episode", "Reward"),
+    "steps": ("steps.png", "Steps per Episode", "Episode", "Steps"),
+}
+
+
+def downsample(values, max_points=2000):
+    '''
+    Splits values into at most max_points buckets and returns the center, mean, min and max of every bucket,
+    so a plot of millions of values stays small and still shows the spikes.
+    '''
+    count = len(values)
+    bucket = max(1, -(-count // max_points))
+    full = count // bucket * bucket
+
+    buckets = np.asarray(values[:full], dtype=np.float32).reshape(-1, bucket)
+    means, lows, highs = buckets.mean(axis=1), buckets.min(axis=1), buckets.max(axis=1)
+    if full < count:
+        tail = np.asarray(values[full:], dtype=np.float32)
+        means = np.append(means, tail.mean())
+        lows = np.append(lows, tail.min())
+        highs = np.append(highs, tail.max())
+
+    x = np.minimum(np.arange(len(means)) * bucket + (bucket - 1) / 2, count - 1)
+    return x, means, lows, highs
+
+
+def plot_metrics(directory="metrics", out=".", max_points=2000):
+    '''
+    Renders loss.png, rewards.png and steps.png to out from the series logged so far in directory.
+    '''
+    for name, (file, title, xlabel, ylabel) in GRAPHS.items():
+        values = read_series(os.path.join(directory, name + ".f32"))
+
+        plt.figure()
+        if len(values):
+            x, means, lows, highs = downsample(values, max_points)
+            if len(values) > max_points:
+                plt.fill_between(x, lows, highs, alpha=0.3, linewidth=0)
+            plt.plot(x, means)
+        plt.title(title)
+        plt.xlabel(xlabel)
+        plt.ylabel(ylabel)
+        plt.savefig(os.path.join(out, file))
+        plt.close()
@@ -0,0 +1,167 @@
+import cProfile
+import json
+import os
+import time
+
+
+class _Phase:
+    # reused for every `with timer.phase(name)`, so timing a phase allocates nothing
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class PhaseTimer:
+    '''
+    Total monotonic time and number of calls of every named phase since the last reset.
+    '''
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self._phases = {}
+
+    def phase(self, name):
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = _Phase(self, name)
+        return phase
+
+    def add(self, name, seconds):
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def summary(self):
+        return {
+            name: {
+                "seconds": round(total, 6),
+                "count": self.counts[name],
+                "mean_us": round(total / self.counts[name] * 1e6, 2),
+            }
+            for name, total in self.totals.items()
+        }
+
+    def reset(self):
+        self.totals.clear()
+        self.counts.clear()
+
+
+class TrainingProfiler:
+    '''
+    Aggregates the phase timings and episode results of training and writes them every `every` episodes
+    as one JSON line to path (and stdout).
+
+    cProfile can be turned on for the next N episodes of a running training by creating the file
+    `trigger` (its content is N, 10 if empty or not a positive number), the stats are dumped to profile_<first episode>.prof.
+
+    With metrics (an ai.metrics.Metrics) every line also has its running aggregates.
+    '''
+    def __init__(self, path="training.jsonl", every=10, trigger="profile.request", metrics=None):
+        self.path = path
+        self.metrics = metrics
+        self.every = every
+        self.trigger = trigger
+        self.timer = PhaseTimer()
+
+        self.profile = None
+        self.profile_first = 0
+        self.profile_left = 0
+
+        self._reset_window()
+
+    def _reset_window(self):
+        self.window_start = time.perf_counter()
+        self.episodes = 0
+        self.steps = 0
+        self.rewards = []
+
+    def phase(self, name):
+        return self.timer.phase(name)
+
+    def end_episode(self, episode, rewards, steps, epsilon, **extra):
+        self.episodes += 1
+        self.steps += steps
+        self.rewards.append(rewards)
+
+        self._update_profile(episode)
+
+        if episode % self.every == 0:
+            self._emit(episode, epsilon, extra)
+
+    def request_profile(self, episodes=10):
+        self.profile = cProfile.Profile()
+        self.profile_left = episodes
+        self.profile_first = None
+        self.profile.enable()
+
+    def _update_profile(self, episode):
+        if self.profile is not None:
+            if self.profile_first is None:
+                self.profile_first = episode
+            self.profile_left -= 1
+            if self.profile_left <= 0:
+                self.profile.disable()
+                name = f"profile_{self.profile_first}.prof"
+                self.profile.dump_stats(name)
+                self._write({"event": "profile", "episode": episode, "file": name})
+                self.profile = None
+        elif os.path.exists(self.trigger):
+            try:
+                with open(self.trigger) as f:
+                    content = f.read().strip()
+                os.remove(self.trigger)
+            except OSError as error:
+                # removed or unreadable in the meantime, the training goes on without profiling
+                self._write({"event": "profile", "episode": episode, "error": str(error)})
+                return
+            self.request_profile(self._trigger_episodes(episode, content))
+
+    def _trigger_episodes(self, episode, content):
+        # anything but a positive number of episodes profiles the default 10, the training must not stop for it
+        if not content:
+            return 10
+        try:
+            episodes = int(content)
+        except ValueError:
+            episodes = 0
+        if episodes <= 0:
+            self._write({"event": "profile", "episode": episode, "error": f"bad {self.trigger} content {content!r}, profiling 10 episodes"})
+            return 10
+        return episodes
+
+    def _emit(self, episode, epsilon, extra):
+        elapsed = time.perf_counter() - self.window_start
+        record = {
+            "episode": episode,
+            "episodes": self.episodes,
+            "steps": self.steps,
+            "epsilon": epsilon,
+            "reward_mean": sum(self.rewards) / len(self.rewards),
+            "reward_max": max(self.rewards),
+            "seconds": round(elapsed, 6),
+            "steps_per_second": round(self.steps / elapsed, 2) if elapsed > 0 else None,
+            "phases": self.timer.summary(),
+        }
+        if self.metrics is not None:
+            record["metrics"] = self.metrics.summary()
+        record.update(extra)
+        self._write(record)
+
+        self.timer.reset()
+        self._reset_window()
+
+    def _write(self, record):
+        line = json.dumps(record)
+        print(line)
+        with open(self.path, "a") as f:
+            f.write(line + "\n")
@@ -3,25 +3,207 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
-import random
-from collections import deque, namedtuple
+import numpy as np
+from collections import namedtuple
 
 Transition = namedtuple('Transition',
                         ('state', 'next_state', 'reward', 'done'))
 
 class ReplayMemory(object):
-    def __init__(self, capacity):
+    '''
+    Ring buffer of transitions in preallocated arrays, once it is full the oldest ones are overwritten.
+    A state is the 7 grade_board features, the next state of a final transition is all zeros.
+    Every pushed transition is also appended to archive (a TransitionArchive) when one is set.
+    '''
+    def __init__(self, capacity, device="cpu"):
         self.capacity = capacity
-        self.memory = deque([], maxlen=capacity)
+        self.device = device
+
+        self.states = np.zeros((capacity, 7), dtype=np.float32)
+        self.next_states = np.zeros((capacity, 7), dtype=np.float32)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=bool)
+
+        self.position = 0
+        self.size = 0
+        self.rng = np.random.default_rng()
+        self.archive = None
+
+    def push(self, state, next_state, reward, done):
+        self.states[self.position] = state
+        self.next_states[self.position] = 0 if next_state is None else next_state
+        self.rewards[self.position] = reward
+        self.dones[self.position] = done
+        if self.archive is not None:
+            self.archive.append(self.states[self.position], self.next_states[self.position], reward, done)
+
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def push_many(self, states, next_states, rewards, dones):
+        if self.archive is not None:
+            self.archive.append_many(states, next_states, rewards, dones)
+
+        count = len(states)
+        if count > self.capacity: # only the last capacity ones would survive anyway
+            states, next_states, rewards, dones = states[-self.capacity:], next_states[-self.capacity:], rewards[-self.capacity:], dones[-self.capacity:]
+            count = self.capacity
+
+        indices = (self.position + np.arange(count)) % self.capacity
+        self.states[indices] = states
+        self.next_states[indices] = next_states
+        self.rewards[indices] = rewards
+        self.dones[indices] = dones
 
-    def push(self, *args):
-        self.memory.append(Transition(*args))
+        self.position = (self.position + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
 
     def sample(self, batch_size):
-        return random.sample(self.memory, batch_size)
+        '''
+        batch_size different transitions as a Transition of (batch_size, 7), (batch_size, 7),
+        (batch_size,) and (batch_size,) tensors.
+        '''
+        indices = self.rng.choice(self.size, batch_size, replace=False)
+        return self._gather(indices)
+
+    def _gather(self, indices):
+        return Transition(
+            torch.from_numpy(self.states[indices]).to(self.device),
+            torch.from_numpy(self.next_states[indices]).to(self.device),
+            torch.from_numpy(self.rewards[indices]).to(self.device),
+            torch.from_numpy(self.dones[indices]).to(self.device),
+        )
+
+    def state_dict(self):
+        '''
+        Copies of the stored transitions and of the sampling state, load_state_dict() restores them.
+        '''
+        return {
+            "states": self.states[:self.size].copy(),
+            "next_states": self.next_states[:self.size].copy(),
+            "rewards": self.rewards[:self.size].copy(),
+            "dones": self.dones[:self.size].copy(),
+            "position": self.position,
+            "size": self.size,
+            "rng": self.rng.bit_generator.state,
+        }
+
+    def load_state_dict(self, state):
+        size = state["size"]
+        self.states[:size] = state["states"]
+        self.next_states[:size] = state["next_states"]
+        self.rewards[:size] = state["rewards"]
+        self.dones[:size] = state["dones"]
+        self.position = state["position"]
+        self.size = size
+        self.rng.bit_generator.state = state["rng"]
 
     def __len__(self):
-        return len(self.memory)
+        return self.size
+
+class SumTree(object):
+    '''
+    Binary tree where every node holds the sum of its children, so the leaves can be sampled in
+    proportion to their values and updated in O(log n).
+    '''
+    def __init__(self, capacity):
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.tree = np.zeros(2 * self.leaves, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indices):
+        return self.tree[self.leaves + indices]
+
+    def update(self, indices, values):
+        nodes = self.leaves + np.asarray(indices)
+        self.tree[nodes] = values
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            if nodes[0] == 1:
+                break
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        '''
+        Index of the leaf where each value falls in the running sum of the leaves.
+        '''
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.leaves:
+            left = self.tree[2 * nodes]
+            go_right = values > left
+            values -= left * go_right
+            nodes = 2 * nodes + go_right
+        return nodes - self.leaves
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    '''
+    Proportional prioritized replay (https://arxiv.org/abs/1511.05952): transitions are sampled with
+    probability priority^alpha, new ones get the highest priority seen so far, and the importance sampling
+    weights correct the bias with an exponent beta that goes up to 1 over beta_steps samples.
+    '''
+    def __init__(self, capacity, device="cpu", alpha=0.6, beta=0.4, beta_steps=100_000, epsilon=1e-5):
+        super().__init__(capacity, device)
+        self.tree = SumTree(capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = (1.0 - beta) / beta_steps
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+
+    def push(self, state, next_state, reward, done):
+        position = self.position
+        super().push(state, next_state, reward, done)
+        self.tree.update([position], self.max_priority ** self.alpha)
+
+    def push_many(self, states, next_states, rewards, dones):
+        count = min(len(states), self.capacity)
+        indices = (self.position + np.arange(count)) % self.capacity
+        super().push_many(states, next_states, rewards, dones)
+        self.tree.update(indices, self.max_priority ** self.alpha)
+
+    def sample(self, batch_size):
+        '''
+        Returns (batch, weights, indices), weights is a (batch_size,) tensor of importance sampling weights
+        and indices are what update_priorities expects.
+        '''
+        # one value in each of batch_size equal segments of the total
+        segment = self.tree.total() / batch_size
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+        indices = np.minimum(self.tree.find(values), self.size - 1)
+
+        probabilities = self.tree.get(indices) / self.tree.total()
+        weights = (self.size * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        weights = torch.from_numpy(weights.astype(np.float32)).to(self.device)
+        return self._gather(indices), weights, indices
+
+    def state_dict(self):
+        state = super().state_dict()
+        state["tree"] = self.tree.tree.copy()
+        state["max_priority"] = self.max_priority
+        state["beta"] = self.beta
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.tree.tree[:] = state["tree"]
+        self.max_priority = state["max_priority"]
+        self.beta = state["beta"]
+
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices, priorities ** self.alpha)
+
 
 class QNetworkA(nn.Module):
     def __init__(self):
@@ -1,15 +1,22 @@
-from .q_network import QNetworkA, ReplayMemory, Transition
+from .q_network import QNetworkA, ReplayMemory, PrioritizedReplayMemory
+from .distributed import ActorPool
+from .profiling import TrainingProfiler
+from .metrics import Metrics
+from .archive import TransitionArchive, ArchiveLoader
+from .checkpoint import AsyncSaver, rng_states, set_rng_states, write_checkpoint, load_checkpoint
 from tetris import Tetris
+from vec_tetris import VecTetris
 import torch
 import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
 import random
 import math
-import matplotlib.pyplot as plt
+import copy
+import numpy as np
 
 class TetrisNetwork:
-    def __init__(self, env: Tetris, load=False, epsilon_start=1.0, epsilon_min=0.001, epsilon_decay=110_000, learning_rate=1e-4):
+    def __init__(self, env: Tetris, load=False, epsilon_start=1.0, epsilon_min=0.001, epsilon_decay=110_000, learning_rate=1e-4, prioritized=False, metrics_dir="metrics", resume=None, save_replay=False, archive=None):
         self.device = torch.device(
             "cuda" if torch.cuda.is_available() else
             "mps" if torch.backends.mps.is_available() else
@@ -19,7 +26,14 @@ class TetrisNetwork:
         
         self.env = env
         self.BATCH_SIZE = 512
-        self.exp_buffer = ReplayMemory(20_000)
+        self.prioritized = prioritized
+        if prioritized:
+            self.exp_buffer = PrioritizedReplayMemory(20_000, self.device)
+        else:
+            self.exp_buffer = ReplayMemory(20_000, self.device)
+        if archive is not None:
+            # every transition of the training is also kept on disk, for pretrain()
+            self.exp_buffer.archive = TransitionArchive(archive)
         
         self.steps_done = 0
         self.epsilon = epsilon_start
@@ -28,21 +42,36 @@ class TetrisNetwork:
         self.epsilon_decay = epsilon_decay
         self.learning_rate = learning_rate
         self.GAMMA = 0.99
+        self.SYNC_EPISODES = 10 # how often actor processes get new weights with train(workers)
+        self.CHECKPOINT_EPISODES = 200 # how often the full training state is saved to checkpoint_path
+        self.checkpoint_path = "checkpoint"
+        self.save_replay = save_replay # checkpoints also hold the replay memory, compressed
+
+        self.start_episode = 1
+        self.max_reward = 0
 
         self.network = QNetworkA().to(self.device)
         if load:
-            self.network.load_state_dict(torch.load("network", weights_only=True))
+            self.network.load_state_dict(torch.load("network", map_location=self.device, weights_only=True))
             self.network.eval()
             print("Loaded")
 
         self.optimizer = optim.AdamW(self.network.parameters(), lr=self.learning_rate)
 
-        self.loss_history = []
-        self.reward_history = []
-        self.steps_per_episode = []
+        # loss, reward and steps series, streamed to metrics_dir (None keeps only the running aggregates)
+        self.metrics = Metrics(metrics_dir, append=resume is not None)
+
+        # per phase timings of train(), written to training.jsonl every 10 episodes
+        self.profiler = TrainingProfiler(metrics=self.metrics)
+
+        # models and checkpoints are written by a background thread, close() waits for them
+        self.saver = AsyncSaver()
+        if resume is not None:
+            self._restore(resume)
+            print(f"Resumed from episode {self.start_episode}")
 
     def select_action(self, candidates):
-        self.epsilon = self.epsilon_min + (self.epsilon_start - self.epsilon_min) * math.exp(-1 * self.steps_done / self.epsilon_decay)
+        self._update_epsilon()
         
         self.steps_done += 1
 
@@ -50,31 +79,56 @@ class TetrisNetwork:
             return random.randrange(len(candidates))
 
         with torch.no_grad():
-            feature_tensor = torch.tensor(
-                [candidate["features"] for candidate in candidates],
-                dtype=torch.float32,
-                device=self.device
-            )
+            feature_tensor = torch.from_numpy(candidates.features).to(self.device)
             values = self.network(feature_tensor)
             best = values.argmax().item()
 
         return best
 
-    def optimize_model(self):
-        if len(self.exp_buffer) < self.BATCH_SIZE:
-            return
+    def select_actions(self, features, offsets):
+        '''
+        Epsilon greedy choice for every game of a VecTetris, from its prepare_candidates() output,
+        with one forward pass over the candidates of all the games.
+        Returns the chosen candidate of every game, counted from its offset.
+        '''
+        games = len(offsets) - 1
+        self._update_epsilon()
 
-        transitions = self.exp_buffer.sample(self.BATCH_SIZE)
-        batch = Transition(*zip(*transitions))
+        self.steps_done += games
 
-        non_final_mask = torch.tensor(tuple(not d for d in batch.done), dtype=torch.bool, device=self.device)
-        non_final_next_states = torch.cat(
-            [s for s, d in zip(batch.next_state, batch.done) if not d]
-        )
+        explore = [random.uniform(0, 1) < self.epsilon for _ in range(games)]
+        actions = np.zeros(games, dtype=np.int64)
+        if not all(explore):
+            with torch.no_grad():
+                feature_tensor = torch.from_numpy(features).to(self.device)
+                values = self.network(feature_tensor).squeeze(1).cpu().numpy()
 
-        state_batch = torch.cat(batch.state)
-        reward_batch = torch.cat(batch.reward).unsqueeze(1)
-        done_batch = torch.cat(batch.done).unsqueeze(1)
+        for game in range(games):
+            start, end = offsets[game], offsets[game + 1]
+            if explore[game]:
+                actions[game] = random.randrange(end - start)
+            else:
+                actions[game] = values[start:end].argmax()
+
+        return actions
+
+    def optimize_model(self, batch=None):
+        '''
+        One step on a batch of the replay memory, or on the given Transition batch (see pretrain).
+        '''
+        weights = None
+        if batch is None:
+            if len(self.exp_buffer) < self.BATCH_SIZE:
+                return
+
+            if self.prioritized:
+                batch, weights, indices = self.exp_buffer.sample(self.BATCH_SIZE)
+            else:
+                batch = self.exp_buffer.sample(self.BATCH_SIZE)
+
+        state_batch = batch.state
+        reward_batch = batch.reward.unsqueeze(1)
+        done_batch = batch.done.unsqueeze(1)
 
         '''
         Since the model only calculate the grade of the state, it doesn't need the action.
@@ -82,107 +136,308 @@ class TetrisNetwork:
         '''
         state_values = self.network(state_batch)
 
-        next_state_values = torch.zeros(self.BATCH_SIZE, 1, device=self.device)
         with torch.no_grad():
-            next_state_values[non_final_mask] = self.network(non_final_next_states)
+            next_state_values = self.network(batch.next_state)
             next_state_values[done_batch] = 0
 
         expected_values = reward_batch + self.GAMMA * next_state_values
-        loss = F.mse_loss(state_values, expected_values)
+        if weights is not None:
+            td_errors = (state_values - expected_values).squeeze(1)
+            loss = (weights * td_errors.pow(2)).mean()
+            self.exp_buffer.update_priorities(indices, td_errors.detach().cpu().numpy())
+        else:
+            loss = F.mse_loss(state_values, expected_values)
 
         self.optimizer.zero_grad()
         loss.backward()
         self.optimizer.step()
 
-        self.loss_history.append(loss.item())
-        
+        self.metrics.add("loss", loss.item())
+
+    def pretrain(self, directory, epochs=1, seed=None):
+        '''
+        Offline training on the transitions of a TransitionArchive, streamed from disk in shuffled batches.
+        Returns the number of updates, raises ValueError when the archive does not hold a single batch.
+        '''
+        loader = ArchiveLoader(directory, self.BATCH_SIZE, self.device, seed=seed)
+        if len(loader) < self.BATCH_SIZE:
+            raise ValueError(f"{directory} holds {len(loader)} transitions, less than a batch of {self.BATCH_SIZE}")
+        print(f"Pretraining on {len(loader)} transitions")
+
+        self.network.train()
+        updates = 0
+        for epoch in range(epochs):
+            for batch in loader:
+                self.optimize_model(batch)
+                updates += 1
+            print(f"Epoch {epoch + 1}: loss {self.metrics.summary()['loss'].get('mean', float('nan')):.4f}")
+        return updates
+
+    def warm_start(self, directory, epochs=1, seed=None):
+        '''
+        Supervised training on the heuristic agent's games of `main.py generate-dataset`: the value of every
+        board is fit to its recorded outcome. Returns the number of updates, raises ValueError when the
+        dataset does not hold a single batch.
+        '''
+        from dataset import load_shards
+        samples = load_shards(directory)
+        if len(samples) < self.BATCH_SIZE:
+            raise ValueError(f"{directory} holds {len(samples)} boards, less than a batch of {self.BATCH_SIZE}")
+        features = torch.from_numpy(np.ascontiguousarray(samples["features"]))
+        outcomes = torch.from_numpy(np.ascontiguousarray(samples["outcome"]))
+        print(f"Warm start on {len(samples)} boards")
+
+        self.network.train()
+        rng = np.random.default_rng(seed)
+        updates = 0
+        for epoch in range(epochs):
+            order = torch.from_numpy(rng.permutation(len(samples)))
+            for start in range(0, len(samples) - self.BATCH_SIZE + 1, self.BATCH_SIZE):
+                indices = order[start:start + self.BATCH_SIZE]
+                values = self.network(features[indices].to(self.device)).squeeze(1)
+                loss = F.mse_loss(values, outcomes[indices].to(self.device))
+
+                self.optimizer.zero_grad()
+                loss.backward()
+                self.optimizer.step()
+
+                self.metrics.add("loss", loss.item())
+                updates += 1
+            print(f"Epoch {epoch + 1}: loss {self.metrics.summary()['loss'].get('mean', float('nan')):.4f}")
+        return updates
+
     def pick_move(self):
         candidates = self.env.prepare_candidates()
 
         best_action = self.select_action(candidates)
         action = candidates[best_action]
         return action
+
+    def lookahead_move(self, beam=None):
+        '''
+        pick_move with a two ply search over the falling and the next piece, greedy (no exploration).
+        '''
+        def score(features):
+            with torch.no_grad():
+                return self.network(torch.from_numpy(features).to(self.device)).squeeze(1).cpu().numpy()
+
+        return self.env.lookahead_move(score, beam)
         
-    def train(self):
+    def _update_epsilon(self):
+        self.epsilon = self.epsilon_min + (self.epsilon_start - self.epsilon_min) * math.exp(-1 * self.steps_done / self.epsilon_decay)
+
+    def _push_transition(self, state, observation, reward, done):
+        # returns the next state
+        next_state = None if done else observation
+        self.exp_buffer.push(state, next_state, reward, done)
+
+        return next_state
+
+    def _end_episode(self, episode, rewards, steps, max_reward):
+        profiler = self.profiler
+        with profiler.phase("save_model"):
+            if episode % 200 == 0:
+                self.save_model()
+
+            if rewards > max_reward:
+                max_reward = rewards
+                self.save_model("max_reward_network")
+
+        with profiler.phase("optimize_model"):
+            self.optimize_model()
+            self.optimize_model()
+
+        self.metrics.add("reward", rewards)
+        self.metrics.add("steps", steps)
+        profiler.end_episode(episode, rewards, steps, self.epsilon, max_reward=max_reward)
+
+        # last, so a resumed training starts exactly where this episode left everything
+        with profiler.phase("checkpoint"):
+            if episode % self.CHECKPOINT_EPISODES == 0:
+                self.save_checkpoint(episode, max_reward)
+
+        return max_reward
+
+    def train(self, workers=0, engine=None, envs=0):
+        '''
+        With workers > 0 the episodes are played by that many actor processes and this process only learns,
+        engine builds their games (the class of self.env by default).
+        With envs > 0 this process plays that many games of a VecTetris at once, see _train_vectorized.
+        '''
+        if workers > 0 and envs > 0:
+            raise ValueError("train with either workers or envs")
+
+        try:
+            if workers > 0:
+                self._train_distributed(workers, engine or type(self.env))
+            elif envs > 0:
+                self._train_vectorized(envs)
+            else:
+                self._train()
+        finally:
+            self.saver.wait()
+
+    def _train(self):
         self.network.train()
-        max_reward = 0
+        max_reward = self.max_reward
+        profiler = self.profiler
+
+        episode = self.start_episode
 
-        episode = 1
         while self.epsilon >= self.epsilon_min:
             state = self.env.reset()
-            state = torch.tensor(state, dtype=torch.float32, device=self.device).unsqueeze(0)
 
             rewards = 0
             steps = 0
             
             while not self.env.done:
                 steps += 1
-                action = self.pick_move()
+                with profiler.phase("prepare_candidates"):
+                    candidates = self.env.prepare_candidates()
+                with profiler.phase("select_action"):
+                    action = self.select_action(candidates)
                 
-                observation, reward, done = self.env.do_move(action["x"], action["y"], action["rot"])
+                with profiler.phase("do_move"):
+                    observation, reward, done = self.env.play_candidate(action)
                 rewards += reward
 
-                reward_tensor = torch.tensor(
-                    [reward],
-                    device=self.device,
-                    dtype=torch.float32
-                )
+                with profiler.phase("push"):
+                    state = self._push_transition(state, observation, reward, done)
 
-                if done:
-                    next_state = None
-                else:
-                    next_state = torch.tensor(observation, dtype=torch.float32, device=self.device).unsqueeze(0)
-
-                done_tensor = torch.tensor([done], dtype=torch.bool, device=self.device)
+            max_reward = self._end_episode(episode, rewards, steps, max_reward)
+            episode += 1
 
-                self.exp_buffer.push(state, next_state, reward_tensor, done_tensor)
+        print(f"Max Rewards: {max_reward}")
 
-                state = next_state
+    def _train_vectorized(self, envs):
+        # the moves of all the games are picked with one forward pass (select_actions), a resumed
+        # training continues the learner's state, the games are new
+        self.network.train()
+        max_reward = self.max_reward
+        profiler = self.profiler
 
-            if episode % 200 == 0:
-                self.save_model()
+        games = VecTetris(envs)
+        states = games.reset()
+        rewards = np.zeros(envs, dtype=np.int64)
+        steps = np.zeros(envs, dtype=np.int64)
 
-            if rewards > max_reward:
-                max_reward = rewards
-                self.save_model("max_reward_network")
+        episode = self.start_episode
+        while self.epsilon >= self.epsilon_min:
+            with profiler.phase("prepare_candidates"):
+                features, offsets = games.prepare_candidates()
+            with profiler.phase("select_action"):
+                actions = self.select_actions(features, offsets)
+
+            with profiler.phase("do_move"):
+                observations, step_rewards, dones = games.do_move(actions)
+            rewards += step_rewards
+            steps += 1
+
+            with profiler.phase("push"):
+                # a finished game already started over, from the empty board (all zero features)
+                next_states = np.where(dones[:, None], 0, observations).astype(np.float32)
+                self.exp_buffer.push_many(states, next_states, step_rewards.astype(np.float32), dones)
+                states = next_states
+
+            for game in np.flatnonzero(dones).tolist():
+                max_reward = self._end_episode(episode, int(rewards[game]), int(steps[game]), max_reward)
+                rewards[game] = 0
+                steps[game] = 0
+                episode += 1
 
-            self.optimize_model()
-            self.optimize_model()
+        print(f"Max Rewards: {max_reward}")
 
-            print(f"At episode: {episode}, steps_done: {steps}, epsilon: {self.epsilon}, reward: {rewards}")
-            self.reward_history.append(rewards)
-            self.steps_per_episode.append(steps)
-            episode += 1
+    def _train_distributed(self, workers, engine):
+        # a resumed distributed training continues the learner's state, the actors' games are new
+        self.network.train()
+        max_reward = self.max_reward
+
+        profiler = self.profiler
+
+        pool = ActorPool(workers, engine, self.network, self.epsilon)
+        try:
+            episode = self.start_episode
+            while self.epsilon >= self.epsilon_min:
+                with profiler.phase("wait_for_actors"):
+                    worker, transitions, rewards = pool.next_episode()
+
+                with profiler.phase("push"):
+                    states, next_states, reward_list, dones = zip(*transitions)
+                    self.exp_buffer.push_many(
+                        np.array(states, dtype=np.float32),
+                        np.array([[0] * 7 if next_state is None else next_state for next_state in next_states], dtype=np.float32),
+                        np.array(reward_list, dtype=np.float32),
+                        np.array(dones, dtype=bool),
+                    )
+
+                self.steps_done += len(transitions)
+                self._update_epsilon()
+
+                max_reward = self._end_episode(episode, rewards, len(transitions), max_reward)
+                with profiler.phase("publish"):
+                    if episode % self.SYNC_EPISODES == 0:
+                        pool.publish(self.network, self.epsilon)
+                    else:
+                        pool.set_epsilon(self.epsilon)
+                episode += 1
+        finally:
+            pool.close()
 
         print(f"Max Rewards: {max_reward}")
 
-    
     def save_model(self, name="network"):
-        torch.save(self.network.state_dict(), name)
-
-    def save_graphs(self):
-        plt.figure()
-        plt.plot(self.loss_history)
-        plt.title("Training Loss")
-        plt.xlabel("Optimization Step")
-        plt.ylabel("Loss")
-        plt.savefig("loss.png")
-        plt.close()
-
-        # Rewards
-        plt.figure()
-        plt.plot(self.reward_history)
-        plt.title("Episode Reward")
-        plt.xlabel("Episode")
-        plt.ylabel("Reward")
-        plt.savefig("rewards.png")
-        plt.close()
-
-        # Steps per episode
-        plt.figure()
-        plt.plot(self.steps_per_episode)
-        plt.title("Steps per Episode")
-        plt.xlabel("Episode")
-        plt.ylabel("Steps")
-        plt.savefig("steps.png")
-        plt.close()
+        weights = {key: value.detach().clone() for key, value in self.network.state_dict().items()}
+        self.saver.save(weights, name)
+
+    def save_checkpoint(self, episode, max_reward, path=None):
+        '''
+        Everything train() needs to go on after episode: weights, optimizer, epsilon schedule, RNG states,
+        the pieces the next game starts with, metrics and, with save_replay, the replay memory. Copied here, written in the background.
+        '''
+        state = {
+            "episode": episode,
+            "max_reward": max_reward,
+            "steps_done": self.steps_done,
+            "epsilon": self.epsilon,
+            "prioritized": self.prioritized,
+            "network": {key: value.detach().clone() for key, value in self.network.state_dict().items()},
+            "optimizer": copy.deepcopy(self.optimizer.state_dict()),
+            "rng": rng_states(),
+            "pieces": self.env.piece_state(),
+            "metrics": self.metrics.state_dict(),
+        }
+        if self.save_replay:
+            state["replay"] = self.exp_buffer.state_dict()
+
+        self.saver.save(state, path or self.checkpoint_path, write_checkpoint)
+
+    def _restore(self, path):
+        state = load_checkpoint(path, self.device)
+        if "replay" in state and state["prioritized"] != self.prioritized:
+            raise ValueError(f"{path} was saved with prioritized={state['prioritized']}")
+
+        self.network.load_state_dict(state["network"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.steps_done = state["steps_done"]
+        self.epsilon = state["epsilon"]
+        self.start_episode = state["episode"] + 1
+        self.max_reward = state["max_reward"]
+        self.metrics.load_state_dict(state["metrics"])
+        if "replay" in state:
+            self.exp_buffer.load_state_dict(state["replay"])
+        self.env.set_piece_state(state["pieces"])
+        set_rng_states(state["rng"])
+
+    def close(self):
+        # waits for the models and checkpoints that are still being written
+        self.metrics.flush()
+        if self.exp_buffer.archive is not None:
+            self.exp_buffer.archive.close()
+        self.saver.close()
+
+    def save_graphs(self, out="."):
+        # the same graphs can be rendered at any time during training with `python main.py plot`
+        self.metrics.flush()
+        if self.metrics.directory is not None:
+            from .plots import plot_metrics
+            plot_metrics(self.metrics.directory, out)
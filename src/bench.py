@@ -0,0 +1,305 @@
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import numpy as np
+from tetris import Hit
+
+'''
+Headless benchmarks. Every benchmark is seeded and reports how many operations it does per second,
+results are saved as JSON and can be compared with an older run to flag regressions.
+'''
+
+REGRESSION = 0.10 # slower than the baseline by more than this is a regression
+
+# most time a main.py subcommand may spend importing, in ms (python -X importtime, see import_time())
+STARTUP_BUDGET_MS = {
+    "play": 400,
+    "ai-play": 400,
+    "train": 4000,
+    "pretrain": 4000,
+    "export": 4000,
+    "bench": 400,
+    "plot": 1200,
+    "evaluate": 4000,
+    "generate-dataset": 400,
+    "tune-heuristic": 400,
+}
+
+
+def _rate(run, min_time, repeats=3):
+    # run(n) does n operations and can return the time they took if it has setup work of its own,
+    # the best of a few rounds is the least noisy
+    best = 0.0
+    n = 1
+    for _ in range(repeats):
+        while True:
+            start = time.perf_counter()
+            elapsed = run(n)
+            if elapsed is None:
+                elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+            n *= 2
+        best = max(best, n / elapsed)
+    return best
+
+
+def _quiet(function):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return function()
+
+
+def _midgame(engine, seed, pieces=25):
+    # a game after some heuristic moves, so the boards look like real ones
+    random.seed(seed)
+    game = engine()
+    for _ in range(pieces):
+        _quiet(game.agent_random_move)
+        if game.is_done():
+            game.reset()
+    return game
+
+
+def bench_can_draw(engine, seed, min_time):
+    game = _midgame(engine, seed)
+
+    def run(n):
+        for _ in range(n):
+            game.can_draw(game.x, game.y, Hit.ALL)
+    return _rate(run, min_time)
+
+
+def bench_clear_up_lines(engine, seed, min_time):
+    game = _midgame(engine, seed)
+    game._remove_piece()
+    full = game.board.copy()
+    full[16:20, 2:12] = 1 # four full rows to clear
+    game.set_board(full)
+    state = game.snapshot()
+
+    def run(n):
+        # only clear_up_lines is timed, not putting the full rows back
+        elapsed = 0.0
+        for _ in range(n):
+            game.restore(state)
+            start = time.perf_counter()
+            game.clear_up_lines()
+            elapsed += time.perf_counter() - start
+        return elapsed
+    return _rate(run, min_time)
+
+
+def bench_grade_board(engine, seed, min_time):
+    game = _midgame(engine, seed)
+
+    def run(n):
+        for _ in range(n):
+            game.grade_board(False)
+    return _rate(run, min_time)
+
+
+def bench_every_possible_end_move(engine, seed, min_time):
+    game = _midgame(engine, seed)
+    game._remove_piece()
+
+    def run(n):
+        for _ in range(n):
+            game.every_possible_end_move(game.x, game.y, False)
+    return _rate(run, min_time)
+
+
+def bench_prepare_candidates(engine, seed, min_time):
+    game = _midgame(engine, seed)
+
+    def run(n):
+        for _ in range(n):
+            game.prepare_candidates()
+    return _rate(run, min_time)
+
+
+def bench_do_move(engine, seed, min_time):
+    random.seed(seed)
+    game = engine()
+    pick = random.Random(seed)
+
+    def run(n):
+        elapsed = 0.0
+        for _ in range(n):
+            candidates = game.prepare_candidates()
+            move = candidates[pick.randrange(len(candidates))]
+            start = time.perf_counter()
+            game.do_move(move["x"], move["y"], move["rot"])
+            elapsed += time.perf_counter() - start
+            if game.done:
+                game.reset()
+        return elapsed
+    return _rate(run, min_time)
+
+
+def bench_lookahead_move(engine, seed, min_time):
+    game = _midgame(engine, seed)
+
+    def run(n):
+        for _ in range(n):
+            game.lookahead_move()
+    return _rate(run, min_time)
+
+
+def bench_heuristic_game(engine, seed, min_time):
+    # pieces per second of full games played by agent_random_move
+    random.seed(seed)
+    game = engine()
+
+    def run(n):
+        for _ in range(n):
+            _quiet(game.agent_random_move)
+            if game.is_done():
+                game.reset()
+    return _rate(run, min_time)
+
+
+def bench_select_action(engine, seed, min_time):
+    # candidates scored per second by the network, without exploration
+    from ai.tetris_network import TetrisNetwork
+    import torch
+
+    torch.manual_seed(seed)
+    game = _midgame(engine, seed)
+    network = _quiet(lambda: TetrisNetwork(game, epsilon_start=0.0, epsilon_min=0.0, metrics_dir=None))
+    candidates = game.prepare_candidates()
+
+    def run(n):
+        for _ in range(n):
+            network.select_action(candidates)
+    return _rate(run, min_time) * len(candidates)
+
+
+def bench_optimize_model(engine, seed, min_time):
+    from ai.tetris_network import TetrisNetwork
+    import torch
+
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    network = _quiet(lambda: TetrisNetwork(engine(), metrics_dir=None))
+    count = network.exp_buffer.capacity
+    network.exp_buffer.push_many(
+        rng.integers(0, 20, (count, 7)).astype(np.float32),
+        rng.integers(0, 20, (count, 7)).astype(np.float32),
+        rng.integers(-5, 40, count).astype(np.float32),
+        rng.random(count) < 0.05,
+    )
+
+    def run(n):
+        for _ in range(n):
+            network.optimize_model()
+    return _rate(run, min_time)
+
+
+# name: (function, unit, needs torch)
+BENCHMARKS = {
+    "can_draw": (bench_can_draw, "calls/s", False),
+    "clear_up_lines": (bench_clear_up_lines, "calls/s", False),
+    "grade_board": (bench_grade_board, "calls/s", False),
+    "every_possible_end_move": (bench_every_possible_end_move, "calls/s", False),
+    "prepare_candidates": (bench_prepare_candidates, "calls/s", False),
+    "do_move": (bench_do_move, "calls/s", False),
+    "lookahead_move": (bench_lookahead_move, "calls/s", False),
+    "heuristic_game": (bench_heuristic_game, "pieces/s", False),
+    "select_action": (bench_select_action, "candidates/s", True),
+    "optimize_model": (bench_optimize_model, "updates/s", True),
+}
+
+
+def run_benchmarks(engine, seed=0, min_time=0.2, names=None, torch=True):
+    results = {}
+    for name, (function, unit, needs_torch) in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        if needs_torch and not torch:
+            continue
+        rate = function(engine, seed, min_time)
+        results[name] = {"rate": rate, "unit": unit}
+        print(f"{name:<26}{rate:>14,.1f} {unit}")
+
+    return {
+        "meta": {
+            "engine": getattr(engine, "__name__", str(engine)),
+            "seed": seed,
+            "min_time": min_time,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold=REGRESSION):
+    '''
+    Prints the change of every benchmark against the baseline report, returns the names that got slower than threshold.
+    '''
+    regressions = []
+    for name, result in report["results"].items():
+        if name not in baseline["results"]:
+            continue
+        old = baseline["results"][name]["rate"]
+        change = result["rate"] / old - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<26}{change:>+8.1%}{flag}")
+    return regressions
+
+
+def save_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def import_time(modules, repeats=3):
+    '''
+    Milliseconds a new interpreter spends importing main and modules, the sum of the top level entries
+    of python -X importtime, best of repeats runs.
+    '''
+    code = "; ".join(["import main"] + [f"import {module}" for module in modules])
+    best = float("inf")
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        total = 0
+        for line in result.stderr.splitlines():
+            # "import time:  self | cumulative | name", nested imports have their name indented
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+                total += int(cumulative)
+        best = min(best, total / 1000)
+    return best
+
+
+def check_startup(command_imports, budgets=STARTUP_BUDGET_MS):
+    '''
+    Prints the import time of every subcommand against its budget, returns the ones over it.
+    '''
+    over = []
+    for command, modules in command_imports.items():
+        milliseconds = import_time(modules)
+        flag = ""
+        if milliseconds > budgets[command]:
+            over.append(command)
+            flag = "  OVER BUDGET"
+        print(f"{command:<10}{milliseconds:>8.0f} ms / {budgets[command]} ms{flag}")
+    return over
@@ -0,0 +1,231 @@
+import numpy as np
+import copy
+from tetris import Tetris, Hit
+from pieces import ROTATIONS
+from features import heuristic_score
+
+# Every row of the 22x14 board is stored as an int, bit `col` set when board[row][col] == 1
+WIDTH = 14
+FULL_ROW = (1 << WIDTH) - 1
+WALLS = 0b11 | (0b11 << 12)
+PLAYFIELD = FULL_ROW & ~WALLS # columns 2..11
+INNER = FULL_ROW & ~0b1 & ~(1 << 13) # columns 1..12, what clear_up_lines looks at
+EMPTY_ROW = WALLS
+COLUMNS = np.arange(WIDTH)
+
+
+def _row_masks(matrix):
+    return [sum(1 << col for col in range(len(row)) if row[col] == 1) for row in matrix]
+
+
+def _build_masks():
+    # MASKS[piece][rot] = (row masks, down edge masks, left edge masks, right edge masks)
+    masks = []
+    for per_piece in ROTATIONS:
+        per_rot = []
+        for rotation in per_piece:
+            rows = _row_masks(rotation.matrix)
+            # cells whose neighbour below / left / right is outside the piece, like can_draw checks
+            down = [rows[row] & ~(rows[row + 1] if row + 1 < len(rows) else 0) for row in range(len(rows))]
+            left = [mask & ~(mask << 1) for mask in rows]
+            right = [mask & ~(mask >> 1) for mask in rows]
+            per_rot.append((rows, down, left, right))
+        masks.append(per_rot)
+    return masks
+
+
+MASKS = _build_masks()
+
+
+class BitboardTetris(Tetris):
+    '''
+    Same game as Tetris, but the board is a list of row bitmasks and every rotation of every
+    piece is a precomputed list of row masks, so collisions, placing and clearing lines are bitwise ops.
+    `board` is still available as a 22x14 numpy array, for the window and for the move search, which
+    is the NumPy one of Tetris (placements.reachable_placements) and no faster here.
+    '''
+    def __init__(self, cache=None, seed=None):
+        self.rot = 0
+        self._board_key = None
+        self._board_cache = None
+        super().__init__(cache, seed)
+
+    def _init_game(self):
+        self.rows = [EMPTY_ROW for _ in range(20)]
+        self.rows.append(FULL_ROW) # padding down
+        self.rows.append(FULL_ROW) # padding down
+        self.done = False
+        self.lines = 0
+        self.moves = []
+
+    @property
+    def board(self):
+        key = tuple(self.rows)
+        if key != self._board_key:
+            self._board_cache = (np.array(key)[:, None] >> COLUMNS) & 1
+            self._board_key = key
+        return self._board_cache
+
+    @board.setter
+    def board(self, board):
+        self.rows = _row_masks(board)
+
+    def set_board(self, board):
+        # the rows are all there is, no hash or counters to keep
+        self.board = board
+
+    def board_key(self):
+        # the rows already are an exact, hashable key
+        return tuple(self.rows)
+
+    @property
+    def cur_piece(self):
+        return ROTATIONS[self.cur_piece_index][self.rot].matrix
+
+    @cur_piece.setter
+    def cur_piece(self, piece):
+        for rot in range(4):
+            if np.array_equal(ROTATIONS[self.cur_piece_index][rot].matrix, piece):
+                self.rot = rot
+                return
+        raise ValueError("Not a rotation of the current piece")
+
+    def set_rotation(self, rot):
+        self.rot = rot
+
+    # the rows already are the packed snapshot and undo format
+    def _packed_rows(self):
+        return tuple(self.rows)
+
+    def _unpack_rows(self, rows):
+        self.rows[:] = rows
+
+    def _copy_state(self):
+        self.rows = list(self.rows)
+        self.rng = copy.deepcopy(self.rng)
+        self.moves = list(self.moves)
+
+    def _save_rows(self, bottom):
+        return self.rows[:bottom]
+
+    def _load_rows(self, rows):
+        self.rows[:len(rows)] = rows
+
+    def _insert_piece(self, x = None, y = None, val = 1):
+        if x is None:
+            x = self.x
+        if y is None:
+            y = self.y
+
+        for row, mask in enumerate(MASKS[self.cur_piece_index][self.rot][0]):
+            self.rows[y + row] |= mask << x
+
+    def _remove_piece(self, x = None, y = None):
+        if x is None:
+            x = self.x
+        if y is None:
+            y = self.y
+
+        for row, mask in enumerate(MASKS[self.cur_piece_index][self.rot][0]):
+            self.rows[y + row] &= ~(mask << x)
+
+    def can_draw(self, x, y, what):
+        _, down, left, right = MASKS[self.cur_piece_index][self.rot]
+        rows = self.rows
+
+        check_down = what in (Hit.DOWN, Hit.ALL)
+        check_left = what in (Hit.LEFT, Hit.ALL)
+        check_right = what in (Hit.RIGHT, Hit.ALL)
+        # row by row like Tetris.can_draw, so a hit near the padding returns before reading past it
+        for row in range(len(down)):
+            if check_down and down[row] and rows[y + row + 1] & (down[row] << x):
+                return Hit.DOWN
+            if check_left and left[row] and rows[y + row] & ((left[row] << x) >> 1):
+                return Hit.LEFT
+            if check_right and right[row] and rows[y + row] & (right[row] << (x + 1)):
+                return Hit.RIGHT
+
+        return Hit.NO_HIT
+
+    def clear_up_lines(self):
+        # Row 0 is never cleared and gets copied into the freed rows, same as Tetris.clear_up_lines
+        kept = [row for row in self.rows[1:20] if row & INNER != INNER]
+        cleared = 19 - len(kept)
+        if cleared:
+            self.rows[1:20] = [self.rows[0]] * cleared + kept
+
+    def _column_heights(self):
+        heights = [0] * WIDTH
+        seen = 0
+        for i in range(20):
+            new = self.rows[i] & PLAYFIELD & ~seen
+            seen |= new
+            while new:
+                lowest = new & -new
+                heights[lowest.bit_length() - 1] = 20 - i
+                new ^= lowest
+
+        return heights[2:12]
+
+    def _max_line_height(self):
+        for i in range(20):
+            if self.rows[i] & PLAYFIELD:
+                return 20 - i
+
+        return 0
+
+    def _full_rows(self):
+        return sum(1 for row in self.rows[:20] if row == FULL_ROW)
+
+    def _holes(self):
+        holes = 0
+        open_holes = 0
+
+        covered = 0
+        for row in self.rows[:20]:
+            empty = ~row & FULL_ROW
+            cells = covered & empty
+            if cells:
+                # open when both cells to the left or both cells to the right are empty
+                open_cells = cells & (((empty << 1) & (empty << 2)) | ((empty >> 1) & (empty >> 2)))
+                open_holes += open_cells.bit_count()
+                holes += (cells & ~open_cells).bit_count()
+            covered |= row & PLAYFIELD
+
+        return holes, open_holes
+
+    def _row_transitions(self):
+        row_transitions = 0
+
+        for row in self.rows[:20]:
+            filled = row & PLAYFIELD
+            if filled:
+                empty = ~row & FULL_ROW
+                row_transitions += (filled & (empty << 1)).bit_count() + (filled & (empty >> 1)).bit_count()
+
+        return row_transitions
+
+    def _col_transitions(self):
+        col = 0
+
+        rows = self.rows
+        for i in range(20):
+            filled = rows[i] & PLAYFIELD
+            if filled:
+                # rows[-1] is the bottom padding, like self.board[i - 1] in Tetris
+                col += (filled & ~rows[i - 1]).bit_count() + (filled & ~rows[i + 1]).bit_count()
+
+        return col
+
+    def _bumpiness(self):
+        heights = self._column_heights()
+        return sum(abs(heights[i] - heights[i + 1]) for i in range(len(heights) - 1))
+
+    def grade_board(self, calculate=True):
+        holes, open_holes = self._holes()
+        features = (holes, open_holes, self._bumpiness(), self._row_transitions(),
+                    self._col_transitions(), self._max_line_height(), self._full_rows())
+
+        if calculate:
+            return heuristic_score(features)
+        return features
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+# rough size of one cached graded_moves entry, the dict and its lists + every (x, y, grade) move,
+# also used for the CandidateSets of prepare_candidates
+ENTRY_BYTES = 600
+MOVE_BYTES = 200
+
+
+class CandidateCache:
+    '''
+    Bounded LRU cache of graded_moves results, keyed by (board hash, piece, rotation, x, y, calculate),
+    and of prepare_candidates CandidateSets (calculate is "candidates" there).
+    Once the estimated size goes over max_bytes the least recently used entries are evicted.
+    '''
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, end_moves):
+        moves = sum(len(moves) for moves in end_moves.values()) if isinstance(end_moves, dict) else len(end_moves)
+        size = ENTRY_BYTES + MOVE_BYTES * moves
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+
+        self.entries[key] = (end_moves, size)
+        self.bytes += size
+
+        while self.bytes > self.max_bytes and self.entries:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,47 @@
+import numpy as np
+from features import board_features
+from placements import place_pieces
+
+
+class CandidateSet:
+    '''
+    The moves of Tetris.prepare_candidates as arrays: xs, ys and rots (turns from the current rotation),
+    in the order of graded_moves (by rot, then as found). The (n, 7) float32 features of the board after
+    every move are only computed the first time they are read, exploration never needs them.
+    candidates[i] is the {"rot", "x", "y", "features"} dict of one move.
+    '''
+    def __init__(self, board, piece, placements, rot):
+        # board is without the falling piece, placements are (x, y, rot) with the absolute rotation
+        turns = (placements[:, 2] - rot) % 4
+        order = np.argsort(turns, kind="stable")
+
+        self.board = board
+        self.piece = piece
+        self.placements = placements[order]
+        self.xs = self.placements[:, 0]
+        self.ys = self.placements[:, 1]
+        self.rots = turns[order]
+        self._features = None
+
+    def __len__(self):
+        return len(self.placements)
+
+    @property
+    def features(self):
+        # contiguous float32, so torch.from_numpy can use it as it is
+        if self._features is None:
+            self._features = board_features(place_pieces(self.board, self.piece, self.placements))
+        return self._features
+
+    def features_of(self, index):
+        # the features of one move, without computing the others
+        if self._features is not None:
+            return self._features[index]
+        return board_features(place_pieces(self.board, self.piece, self.placements[index:index + 1]))[0]
+
+    def move(self, index):
+        return int(self.xs[index]), int(self.ys[index]), int(self.rots[index])
+
+    def __getitem__(self, index):
+        x, y, rot = self.move(index)
+        return {"rot": rot, "x": x, "y": y, "features": tuple(self.features_of(index).astype(int).tolist())}
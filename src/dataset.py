@@ -0,0 +1,69 @@
+import glob
+import os
+import numpy as np
+from games import play_games
+
+'''
+Games of the heuristic agent (Tetris.heuristic_move) recorded for a supervised warm start of the network:
+one shard_<seed>.npy of SAMPLE records per seeded game, played on a pool of processes.
+'''
+
+# features of the board after a move, its heuristic_score, the reward of the move and the outcome: the
+# discounted rewards of the moves made from that board on (what the network learns to predict), done on the last move
+SAMPLE = np.dtype([
+    ("features", np.float32, 7),
+    ("value", np.float32),
+    ("reward", np.float32),
+    ("outcome", np.float32),
+    ("done", np.bool_),
+])
+
+
+def play_game(engine, seed, max_pieces, gamma=0.99):
+    '''
+    One game of engine(seed=seed) played by the heuristic agent until it ends or max_pieces are placed,
+    as (array of SAMPLE, lines cleared). The outcome of a game that was stopped only counts its rewards so far.
+    '''
+    game = engine(seed=seed)
+    game.reset()
+
+    samples = []
+    while not game.done and len(samples) < max_pieces:
+        move = game.heuristic_move()
+        _, reward, done = game.do_move(move["x"], move["y"], move["rot"])
+        samples.append((move["features"], move["value"], reward, 0.0, done))
+
+    samples = np.array(samples, dtype=SAMPLE)
+    outcome = 0.0
+    for i in range(len(samples) - 1, -1, -1):
+        samples["outcome"][i] = outcome
+        outcome = samples["reward"][i] + gamma * outcome
+    return samples, game.lines
+
+
+def _write_shard(engine, seed, max_pieces, directory):
+    samples, lines = play_game(engine, seed, max_pieces)
+    path = os.path.join(directory, f"shard_{seed:06d}.npy")
+    np.save(path + ".tmp.npy", samples)
+    os.replace(path + ".tmp.npy", path)
+    return {"seed": seed, "pieces": len(samples), "lines": lines}
+
+
+def generate(engine, directory="dataset", games=100, seed=0, workers=None, max_pieces=10_000):
+    '''
+    Writes the games seed, seed + 1, ... to directory from workers processes (all the cpus by default),
+    returns the pieces and lines of every game in seed order.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    jobs = [(engine, seed + game, max_pieces, directory) for game in range(games)]
+    return play_games(_write_shard, jobs, workers)
+
+
+def load_shards(directory):
+    '''
+    All the samples of directory in one array, the shards are memory mapped while they are read.
+    '''
+    paths = sorted(glob.glob(os.path.join(directory, "shard_*.npy")))
+    if not paths:
+        return np.zeros(0, dtype=SAMPLE)
+    return np.concatenate([np.load(path, mmap_mode="r") for path in paths])
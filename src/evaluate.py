@@ -0,0 +1,106 @@
+import json
+import time
+import numpy as np
+from ai.numpy_network import NumpyPolicy, export_arrays
+from games import play_games
+
+'''
+Headless evaluation of a network: the same fixed-seed games for every checkpoint, played greedily
+(no exploration) by a pool of processes, summarized as distributions.
+'''
+
+METRICS = ("lines", "pieces", "reward", "decisions_per_second")
+
+
+def load_weights(path):
+    '''
+    The export_arrays of a checkpoint: an exported .npz, a torch state_dict (network, max_reward_network)
+    or a training checkpoint.
+    '''
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return dict(data)
+
+    import torch
+    state = torch.load(path, map_location="cpu", weights_only=False)
+    if "network" in state:
+        state = state["network"]
+    return export_arrays(state)
+
+
+def play_game(engine, weights, seed, max_pieces):
+    '''
+    One game of engine(seed=seed) played by the exported weights until it ends or max_pieces are placed.
+    '''
+    game = engine(seed=seed)
+    policy = NumpyPolicy(game, weights)
+    game.reset()
+
+    pieces = 0
+    reward = 0
+    thinking = 0.0
+    while not game.done and pieces < max_pieces:
+        start = time.perf_counter()
+        action = policy.pick_move()
+        thinking += time.perf_counter() - start
+
+        _, step_reward, _ = game.do_move(action["x"], action["y"], action["rot"])
+        pieces += 1
+        reward += step_reward
+
+    return {
+        "seed": seed,
+        "lines": game.lines,
+        "pieces": pieces,
+        "reward": reward,
+        "decisions_per_second": pieces / thinking if thinking > 0 else 0.0,
+    }
+
+
+def evaluate(engine, weights, games=100, seed=0, workers=None, max_pieces=10_000):
+    '''
+    Plays games seed, seed + 1, ... on workers processes (all the cpus by default), returns their results in seed order.
+    '''
+    jobs = [(engine, weights, seed + game, max_pieces) for game in range(games)]
+    return play_games(play_game, jobs, workers)
+
+
+def summarize(results):
+    summary = {}
+    for metric in METRICS:
+        values = np.array([result[metric] for result in results], dtype=np.float64)
+        p10, p50, p90 = np.percentile(values, (10, 50, 90))
+        summary[metric] = {
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            "min": float(values.min()),
+            "p10": float(p10),
+            "p50": float(p50),
+            "p90": float(p90),
+            "max": float(values.max()),
+        }
+    return summary
+
+
+def print_summary(name, summary):
+    print(f"{name}")
+    print(f"  {'':<22}{'mean':>10}{'std':>10}{'min':>10}{'p10':>10}{'p50':>10}{'p90':>10}{'max':>10}")
+    for metric, stats in summary.items():
+        print(f"  {metric:<22}" + "".join(f"{stats[key]:>10.1f}" for key in ("mean", "std", "min", "p10", "p50", "p90", "max")))
+
+
+def compare(results, baseline, metrics=("lines", "reward")):
+    '''
+    Prints the mean difference of results against baseline (played on the same seeds) with a 95% confidence
+    interval of the paired differences.
+    '''
+    for metric in metrics:
+        difference = np.array([a[metric] - b[metric] for a, b in zip(results, baseline)], dtype=np.float64)
+        margin = 1.96 * difference.std(ddof=1) / np.sqrt(len(difference)) if len(difference) > 1 else float("nan")
+        print(f"  {metric:<22}{difference.mean():>+10.1f} +- {margin:.1f}")
+
+
+def save_results(runs, path):
+    # runs: {checkpoint: results}
+    with open(path, "w") as f:
+        json.dump({name: {"summary": summarize(results), "games": results} for name, results in runs.items()}, f, indent=2)
@@ -0,0 +1,65 @@
+import numpy as np
+
+# features at: https://inria.hal.science/hal-00926213/document page 4 + some of mine
+FEATURES = ("holes", "open_holes", "bumpiness", "row_transitions", "col_transitions", "max_height", "full_rows")
+HEURISTIC_WEIGHTS = np.array([-80.0, -20.0, -8.0, -9.0, -7.0, -25.0, 500.0])
+
+# row above every playfield row, board[i - 1] wraps to the bottom padding for i = 0
+ABOVE = np.arange(-1, 19)
+
+
+def board_features(boards):
+    '''
+    Computes the grade_board feature tuple of a 22x14 board, or of a stacked (N, 22, 14) batch of boards.
+    Returns a (7,) or (N, 7) float32 array in the order of FEATURES.
+    '''
+    boards = np.asarray(boards)
+    single = boards.ndim == 2
+    if single:
+        boards = boards[None]
+
+    filled = boards[:, :20] == 1
+    empty = boards[:, :20] == 0
+    play = filled[:, :, 2:12]
+
+    # height of a column is set by its highest block
+    has_block = play.any(axis=1)
+    heights = np.where(has_block, 20 - play.argmax(axis=1), 0)
+
+    # a hole is any non-block cell under the highest block of its column
+    covered = np.zeros_like(play)
+    covered[:, 1:] = np.logical_or.accumulate(play, axis=1)[:, :-1]
+    hole_cells = covered & ~play
+    # it is open when the two cells to its left or the two cells to its right are empty
+    open_sides = (empty[:, :, 1:11] & empty[:, :, 0:10]) | (empty[:, :, 3:13] & empty[:, :, 4:14])
+    open_cells = hole_cells & open_sides
+
+    row_transitions = (play & empty[:, :, 1:11]).sum(axis=(1, 2)) + (play & empty[:, :, 3:13]).sum(axis=(1, 2))
+    above = boards[:, ABOVE, 2:12] == 0
+    below = boards[:, 1:21, 2:12] == 0
+    col_transitions = (play & above).sum(axis=(1, 2)) + (play & below).sum(axis=(1, 2))
+
+    features = np.stack([
+        (hole_cells & ~open_cells).sum(axis=(1, 2)),
+        open_cells.sum(axis=(1, 2)),
+        np.abs(np.diff(heights, axis=1)).sum(axis=1),
+        row_transitions,
+        col_transitions,
+        heights.max(axis=1),
+        (boards[:, :20] != 0).all(axis=2).sum(axis=1),
+    ], axis=1).astype(np.float32)
+
+    if single:
+        return features[0]
+    return features
+
+
+def heuristic_score(features, weights=HEURISTIC_WEIGHTS):
+    '''
+    Hand weighted grade of a feature tuple, or of every row of an (N, 7) feature array.
+    weights are in the order of FEATURES (e.g. tuned by `main.py tune-heuristic`).
+    '''
+    scores = np.asarray(features, dtype=np.float64) @ np.asarray(weights, dtype=np.float64)
+    if scores.ndim == 0:
+        return float(scores)
+    return scores
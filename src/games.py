@@ -0,0 +1,26 @@
+import multiprocessing as mp
+
+'''
+Seeded games on a pool of processes, shared by evaluate, dataset and tune: every job is the arguments of a
+module level function (so the spawned processes can import it), the results come back in job order.
+'''
+
+
+def game_pool(workers=None):
+    # spawned, so the processes start clean, workers=None is one per cpu
+    return mp.get_context("spawn").Pool(workers)
+
+
+def _call(job):
+    function, args = job
+    return function(*args)
+
+
+def play_games(function, jobs, workers=None, pool=None):
+    '''
+    [function(*args) for args in jobs] on pool, or on a pool of workers processes made for this call.
+    '''
+    if pool is None:
+        with game_pool(workers) as pool:
+            return play_games(function, jobs, pool=pool)
+    return pool.map(_call, [(function, args) for args in jobs])
@@ -0,0 +1,58 @@
+import numpy as np
+from features import board_features
+from pieces import DISTINCT_ROTATIONS
+from placements import reachable_placements, drop_pieces, clear_lines
+from vec_tetris import SPAWN_X, SPAWN_Y
+
+
+def _alive(boards):
+    # like Tetris.is_done after the piece is placed: the height before lines are cleared is at most 16
+    return ~(boards[:, :4, 2:12] == 1).any(axis=(1, 2))
+
+
+def lookahead(board, piece, next_piece, x, y, rot, score, beam=None):
+    '''
+    Two ply search: every placement of piece from (x, y, rot) on board (without the falling piece), each followed
+    by every placement of next_piece from the spawn. All the (current x next) boards are graded by one
+    board_features and one score call, score maps (n, 7) float32 features to (n,) values (heuristic_score, a network).
+    beam keeps only the best beam first placements (by their own score) for the second ply.
+
+    Returns (placements, features, values): the (n, 3) first placements as (x, y, turns from rot) like
+    prepare_candidates, their (n, 7) features and the best value of a second placement after each of them,
+    -inf for the ones that end the game or were cut by the beam. When no two placements keep the game going
+    the values are the first ply's own.
+    '''
+    turns = DISTINCT_ROTATIONS[piece][rot]
+    placements = reachable_placements(board, piece, x, y, [(rot + turn) % 4 for turn in turns])
+
+    boards = np.repeat(board[None], len(placements), axis=0)
+    drop_pieces(boards, piece, placements)
+    alive = _alive(boards)
+    clear_lines(boards)
+    features = board_features(boards)
+    first = np.array(score(features), dtype=np.float64)
+
+    placements[:, 2] = (placements[:, 2] - rot) % 4
+    keep = np.flatnonzero(alive)
+    if beam is not None and len(keep) > beam:
+        keep = np.sort(keep[np.argsort(-first[keep], kind="stable")[:beam]])
+
+    found = [reachable_placements(boards[i], next_piece, SPAWN_X, SPAWN_Y, DISTINCT_ROTATIONS[next_piece][0]) for i in keep]
+    counts = np.array([len(second) for second in found], dtype=np.int64)
+    keep, found, counts = keep[counts > 0], [second for second in found if len(second)], counts[counts > 0]
+    if len(keep) == 0:
+        return placements, features, first
+
+    second = boards[np.repeat(keep, counts)]
+    drop_pieces(second, next_piece, np.concatenate(found))
+    second_alive = _alive(second)
+    clear_lines(second)
+    second_values = np.asarray(score(board_features(second)), dtype=np.float64)
+    second_values[~second_alive] = -np.inf
+
+    values = np.full(len(placements), -np.inf)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    values[keep] = np.maximum.reduceat(second_values, starts)
+    if np.isneginf(values).all():
+        return placements, features, first
+    return placements, features, values
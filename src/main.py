@@ -1,22 +1,139 @@
-import sys
+import argparse
+import os
+from functools import partial
 from tetris import Tetris
-from window import Window
-from ai import tetris_network 
+from bitboard import BitboardTetris
+from cache import CandidateCache
+from ai.numpy_network import DTYPES, export_npz
+
+ENGINES = {"numpy": Tetris, "bitboard": BitboardTetris}
+
+# what every subcommand imports on top of this module: pygame only for the windows, torch only where a torch
+# network is used and matplotlib only for the graphs. `python main.py startup` checks them against bench.STARTUP_BUDGET_MS
+COMMAND_IMPORTS = {
+    "play": ("window",),
+    "ai-play": ("window",),
+    "train": ("ai.tetris_network",),
+    "pretrain": ("ai.tetris_network",),
+    "generate-dataset": ("dataset",),
+    "tune-heuristic": ("tune",),
+    "export": ("torch",),
+    "bench": ("bench",),
+    "plot": ("ai.plots",),
+    "evaluate": ("evaluate", "torch"),
+}
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: python main.py <opt>")
-        exit(0)
+    parser = argparse.ArgumentParser(usage="python main.py <opt>")
+    parser.add_argument("opt", choices=["play", "ai-play", "train", "pretrain", "export", "bench", "plot", "startup", "evaluate", "generate-dataset", "tune-heuristic"])
+    parser.add_argument("checkpoints", nargs="*", help="evaluate: the checkpoints to compare, the first is the baseline")
+    parser.add_argument("--engine", choices=ENGINES.keys(), default="numpy", help="game backend used by the agent")
+    parser.add_argument("--fast-forward", action="store_true", help="the agent of play/ai-play moves as fast as it can think")
+    parser.add_argument("--lookahead", action="store_true", help="the agent of play/ai-play also looks at the next piece")
+    parser.add_argument("--beam", type=int, help="with --lookahead, only the best BEAM first moves are searched further")
+    parser.add_argument("--workers", type=int, default=0, help="train with this many actor processes, evaluate and generate-dataset with this many game processes (0 = one per cpu)")
+    parser.add_argument("--envs", type=int, default=0, help="train on this many games at once in this process, their moves picked in one batch")
+    parser.add_argument("--games", type=int, help="how many seeded games evaluate plays per checkpoint (100), generate-dataset records (100), tune-heuristic plays per sample (5)")
+    parser.add_argument("--max-pieces", type=int, default=10_000, help="evaluate and generate-dataset stop a game after this many pieces")
+    parser.add_argument("--prioritized", action="store_true", help="train with prioritized experience replay")
+    parser.add_argument("--resume", metavar="CHECKPOINT", help="continue the training (or tune-heuristic search) saved in this checkpoint")
+    parser.add_argument("--save-replay", action="store_true", help="training checkpoints also hold the replay memory")
+    parser.add_argument("--archive", metavar="DIR", help="train also appends every transition to this archive, pretrain learns from it")
+    parser.add_argument("--dataset", metavar="DIR", help="generate-dataset writes its shards here (default dataset), pretrain fits the network to them")
+    parser.add_argument("--epochs", type=int, default=1, help="how many passes pretrain makes over the archive or dataset")
+    parser.add_argument("--fine-tune", action="store_true", help="pretrain starts from the saved network instead of new weights")
+    parser.add_argument("--generations", type=int, default=20, help="tune-heuristic stops after this many generations")
+    parser.add_argument("--population", type=int, default=50, help="weight vectors tune-heuristic tries per generation")
+    parser.add_argument("--max-lines", type=int, default=1000, help="tune-heuristic stops a game after this many lines")
+    parser.add_argument("--checkpoint", default="network", help="torch checkpoint to export, written to <checkpoint>.npz")
+    parser.add_argument("--dtype", choices=DTYPES, default="float32", help="how the exported weights are stored")
+    parser.add_argument("--out", help="where bench (default bench.json), evaluate and tune-heuristic (default tune.json) write their results")
+    parser.add_argument("--baseline", help="bench results to compare with, more than 10%% slower fails")
+    parser.add_argument("--metrics", default="metrics", help="directory of the training metrics (pretrain uses its pretrain/ subdirectory), plot renders its graphs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-mb", type=int, default=0, help="cache the agent's candidate moves, up to this many MB (0 = off)")
+    args = parser.parse_args()
+
+    engine = ENGINES[args.engine]
+    if args.cache_mb:
+        engine = partial(engine, cache=CandidateCache(args.cache_mb * 1024 * 1024))
 
-    if sys.argv[1] == "play":
-        window = Window(False)
+    if args.opt == "play":
+        from window import Window
+        window = Window(False, engine=engine, fast_forward=args.fast_forward, lookahead=args.lookahead, beam=args.beam)
         window.start()
-    elif sys.argv[1] == "ai-play":
-        window = Window(True, False)
+    elif args.opt == "ai-play":
+        from window import Window
+        window = Window(True, False, engine=engine, fast_forward=args.fast_forward, lookahead=args.lookahead, beam=args.beam)
         window.start()
-    elif sys.argv[1] == "train":
-        env = Tetris()
-        net = tetris_network.TetrisNetwork(env, False)
-        net.train()
+    elif args.opt == "train":
+        from ai import tetris_network
+        env = engine()
+        net = tetris_network.TetrisNetwork(env, False, prioritized=args.prioritized, metrics_dir=args.metrics,
+                                           resume=args.resume, save_replay=args.save_replay, archive=args.archive)
+        net.train(args.workers, engine, args.envs)
         net.save_model()
+        net.close()
         net.save_graphs()
+        if env.cache is not None:
+            print(f"Candidate cache: {env.cache.stats()}")
+    elif args.opt == "pretrain":
+        from ai import tetris_network
+        # its own metrics and graphs, the ones of the training stay as they are
+        metrics = os.path.join(args.metrics, "pretrain")
+        net = tetris_network.TetrisNetwork(engine(), args.fine_tune, metrics_dir=metrics)
+        updates = 0
+        try:
+            if args.dataset:
+                updates += net.warm_start(args.dataset, args.epochs, args.seed)
+            if args.archive or not args.dataset:
+                updates += net.pretrain(args.archive or "archive", args.epochs, args.seed)
+        finally:
+            # a network that was not trained at all does not replace the saved one
+            if updates:
+                net.save_model()
+            net.close()
+        net.save_graphs(metrics)
+    elif args.opt == "export":
+        import torch
+        export_npz(torch.load(args.checkpoint, map_location="cpu", weights_only=True), args.checkpoint + ".npz", args.dtype)
+    elif args.opt == "bench":
+        import bench
+        report = bench.run_benchmarks(engine, args.seed)
+        bench.save_report(report, args.out or "bench.json")
+        if args.baseline:
+            regressions = bench.compare(report, bench.load_report(args.baseline))
+            if regressions:
+                print(f"Regressions: {', '.join(regressions)}")
+                exit(1)
+    elif args.opt == "plot":
+        from ai.plots import plot_metrics
+        plot_metrics(args.metrics)
+    elif args.opt == "startup":
+        import bench
+        if bench.check_startup(COMMAND_IMPORTS):
+            exit(1)
+    elif args.opt == "evaluate":
+        import evaluate
+        runs = {}
+        for checkpoint in args.checkpoints or ["network"]:
+            results = evaluate.evaluate(engine, evaluate.load_weights(checkpoint), args.games or 100, args.seed,
+                                        args.workers or None, args.max_pieces)
+            evaluate.print_summary(checkpoint, evaluate.summarize(results))
+            if runs:
+                baseline = next(iter(runs))
+                print(f"  against {baseline}:")
+                evaluate.compare(results, runs[baseline])
+            runs[checkpoint] = results
+        if args.out:
+            evaluate.save_results(runs, args.out)
+    elif args.opt == "generate-dataset":
+        import dataset
+        games = dataset.generate(engine, args.dataset or "dataset", args.games or 100, args.seed, args.workers or None, args.max_pieces)
+        print(f"{len(games)} games, {sum(game['pieces'] for game in games)} boards, {sum(game['lines'] for game in games)} lines")
+    elif args.opt == "tune-heuristic":
+        import tune
+        search = tune.tune(engine, args.generations, args.population, args.games or 5, args.max_lines, args.seed,
+                           args.workers or None, args.resume or args.out or "tune.json", args.resume is not None)
+        if search.best_score is not None:
+            print(f"Best on the validation games: {search.best_score:.1f} lines with {search.best_weights.tolist()}")
@@ -0,0 +1,68 @@
+import numpy as np
+from collections import namedtuple
+
+PIECES = [[[0,1,0,0],[0,1,0,0],[0,1,0,0],[0,1,0,0]], # line
+          [[1,1], [1,1]], # square
+          [[0,1,0], [1,1,0], [0,1,0]], # t shaped
+          [[0,0,1], [0,1,1], [0,1,0]], # S shaped
+          [[1,0,0], [1,1,0], [0,1,0]], # Reversed S
+          [[0,1,0], [0,1,0], [0,1,1]], # L
+          [[0,1,0], [0,1,0], [1,1,0]], # Reversed L
+          ]
+
+'''
+matrix: the piece after `rot` clockwise rotations, the same as np.rot90(piece, -rot)
+cells: (row, col) of every occupied cell inside matrix, as an (n, 2) array
+top, left, height, width: the bounding box of the occupied cells inside matrix
+canonical: the first rotation with the same trimmed shape, e.g. 0 for rotation 2 of the line
+'''
+Rotation = namedtuple('Rotation', ('matrix', 'cells', 'top', 'left', 'height', 'width', 'canonical'))
+
+
+def _build_rotations():
+    rotations = []
+    for piece in PIECES:
+        matrix = np.array(piece)
+        per_piece = []
+        shapes = []
+        for rot in range(4):
+            matrix.setflags(write=False)
+            cells = np.argwhere(matrix == 1)
+            cells.setflags(write=False)
+            top, left = cells.min(axis=0)
+            bottom, right = cells.max(axis=0)
+            shape = matrix[top:bottom + 1, left:right + 1]
+
+            canonical = rot
+            for other, other_shape in enumerate(shapes):
+                if np.array_equal(shape, other_shape):
+                    canonical = other
+                    break
+            shapes.append(shape)
+
+            per_piece.append(Rotation(matrix, cells, int(top), int(left), int(bottom - top + 1), int(right - left + 1), canonical))
+            matrix = np.rot90(matrix, -1)
+        rotations.append(tuple(per_piece))
+    return tuple(rotations)
+
+
+def _distinct_rotations():
+    # DISTINCT_ROTATIONS[piece][rot] = the rotations, relative to rot, that give a new shape
+    distinct = []
+    for per_piece in ROTATIONS:
+        per_rot = []
+        for rot in range(4):
+            seen = set()
+            relative = []
+            for turn in range(4):
+                canonical = per_piece[(rot + turn) % 4].canonical
+                if canonical not in seen:
+                    seen.add(canonical)
+                    relative.append(turn)
+            per_rot.append(tuple(relative))
+        distinct.append(tuple(per_rot))
+    return tuple(distinct)
+
+
+ROTATIONS = _build_rotations()
+DISTINCT_ROTATIONS = _distinct_rotations()
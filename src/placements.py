@@ -0,0 +1,122 @@
+import numpy as np
+from collections import deque
+from pieces import ROTATIONS
+
+# Anchors (x, y) are the top left corner of the piece matrix, like Tetris.x and Tetris.y
+ANCHOR_ROWS = 23
+ANCHOR_COLS = 14
+
+
+def _edge_cells(cells, d_row, d_col):
+    # board cells next to the piece in direction (d_row, d_col) that are not part of the piece itself
+    occupied = set(map(tuple, cells.tolist()))
+    return [(row + d_row, col + d_col) for row, col in occupied if (row + d_row, col + d_col) not in occupied]
+
+
+def _build_edges():
+    # EDGES[piece][rot] = (below, left, right) board offsets that can_draw looks at
+    return tuple(
+        tuple((_edge_cells(rotation.cells, 1, 0), _edge_cells(rotation.cells, 0, -1), _edge_cells(rotation.cells, 0, 1))
+              for rotation in per_piece)
+        for per_piece in ROTATIONS
+    )
+
+
+EDGES = _build_edges()
+# CELLS[piece, rot] is the (4 cells, 2) array of (row, col) offsets of a rotation
+CELLS = np.array([[rotation.cells for rotation in per_piece] for per_piece in ROTATIONS])
+
+
+def _padded(board):
+    # one column of wall on the left (board[y][-1] is a wall too) and enough padding under and to the right
+    padded = np.ones((ANCHOR_ROWS + 5, ANCHOR_COLS + 6), dtype=bool)
+    padded[:board.shape[0], 1:board.shape[1] + 1] = board == 1
+    return padded
+
+
+def _collisions(padded, offsets):
+    # hit[y][x] is True when any offset cell of an anchor at (x, y) is a block
+    hit = np.zeros((ANCHOR_ROWS, ANCHOR_COLS), dtype=bool)
+    for row, col in offsets:
+        hit |= padded[row:row + ANCHOR_ROWS, col + 1:col + 1 + ANCHOR_COLS]
+    return hit
+
+
+def reachable_placements(board, piece_index, orig_x, orig_y, rotations=(0,)):
+    '''
+    Every final placement a piece can be moved to from (orig_x, orig_y) with down, left and right moves,
+    in the same order as Tetris.every_possible_end_move. The board must not contain the piece and is not changed.
+    Returns an (n, 3) int array of (x, y, rot) rows, rotation by rotation.
+    '''
+    padded = _padded(board)
+    visited = bytearray(ANCHOR_ROWS * ANCHOR_COLS)
+    placements = []
+
+    for rot in rotations:
+        below, left, right = EDGES[piece_index][rot]
+        hit_down = _collisions(padded, below).tolist()
+        hit_left = _collisions(padded, left).tolist()
+        hit_right = _collisions(padded, right).tolist()
+
+        visited[:] = bytes(len(visited))
+        q = deque()
+        q.append((orig_x, orig_y))
+        visited[orig_y * ANCHOR_COLS + orig_x] = 1
+        while q:
+            x, y = q.popleft()
+            cell = y * ANCHOR_COLS + x
+
+            if hit_down[y][x]:
+                placements.append((x, y, rot))
+            elif not visited[cell + ANCHOR_COLS]:
+                q.append((x, y + 1))
+                visited[cell + ANCHOR_COLS] = 1
+            if not hit_left[y][x] and not visited[cell - 1]:
+                q.append((x - 1, y))
+                visited[cell - 1] = 1
+            if not hit_right[y][x] and not visited[cell + 1]:
+                q.append((x + 1, y))
+                visited[cell + 1] = 1
+
+    return np.array(placements, dtype=np.int64).reshape(-1, 3)
+
+
+def clear_lines(boards):
+    '''
+    Clears the full rows of a stacked (n, 22, 14) batch of boards in place, like Tetris.clear_up_lines:
+    row 0 is never checked and is copied into the rows freed at the top.
+    '''
+    full = (boards[:, 1:20, 1:13] != 0).all(axis=2)
+    cleared = np.flatnonzero(full.any(axis=1))
+    if len(cleared) == 0:
+        return
+
+    full = full[cleared]
+    # stable sort moves the full rows up and keeps the order of the others
+    order = np.argsort(~full, axis=1, kind="stable")
+    rows = np.take_along_axis(boards[cleared, 1:20], order[:, :, None], axis=1)
+    freed = np.arange(19) < full.sum(axis=1)[:, None]
+    rows[freed] = np.repeat(boards[cleared, :1], 19, axis=1)[freed]
+    boards[cleared, 1:20] = rows
+
+
+def drop_pieces(boards, pieces, placements):
+    '''
+    Sets the cells of piece pieces[i] at placements[i] = (x, y, rot) on boards[i], in place.
+    pieces can also be a single piece index for every placement.
+    '''
+    cells = CELLS[pieces, placements[:, 2]]
+    rows = placements[:, 1, None] + cells[:, :, 0]
+    cols = placements[:, 0, None] + cells[:, :, 1]
+    boards[np.arange(len(placements))[:, None], rows, cols] = 1
+
+
+def place_pieces(board, piece_index, placements):
+    '''
+    The boards left after dropping the piece at every (x, y, rot) of placements and clearing lines,
+    as an (n, 22, 14) array. board is not changed.
+    '''
+    boards = np.repeat(board[None], len(placements), axis=0)
+    drop_pieces(boards, piece_index, placements)
+    clear_lines(boards)
+    return boards
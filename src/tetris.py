@@ -1,7 +1,13 @@
 import numpy as np
+import copy
 import random
+from collections import namedtuple
 from enum import Enum
-from queue import Queue
+from features import HEURISTIC_WEIGHTS, board_features, heuristic_score
+from pieces import PIECES, ROTATIONS, DISTINCT_ROTATIONS
+from placements import reachable_placements, place_pieces
+from lookahead import lookahead
+from candidates import CandidateSet
 
 class Hit(Enum):
     NO_HIT = 0
@@ -11,29 +17,34 @@ class Hit(Enum):
     ALL = 4
     WALL = 5
 
-class BFS_STATUS(Enum):
-    DIDNT_VISIT = 0
-    VISIT = 1
-    FINISHED = 2
+# random bits of every board cell, the board hash is the xor of the bits of its blocks (Zobrist hashing)
+ZOBRIST = np.random.default_rng(0).integers(0, np.iinfo(np.uint64).max, size=(22, 14), dtype=np.uint64, endpoint=True)
+
+def _board_hash(board):
+    return int(np.bitwise_xor.reduce(ZOBRIST[board != 0]))
+
+# a row of the board packed as an int, bit `col` set when the cell is not empty (the BitboardTetris layout)
+ROW_BITS = 1 << np.arange(14, dtype=np.int64)
+
+# everything about a game but its random generator, small, immutable and hashable (Tetris.snapshot)
+TetrisState = namedtuple("TetrisState", ("rows", "piece", "next_piece", "x", "y", "rot", "done", "lines"))
 
 class Tetris:
-    def __init__(self):
+    def __init__(self, cache=None, seed=None):
+        # optional CandidateCache in front of graded_moves and prepare_candidates
+        self.cache = cache
+        self.candidates = (None, None) # the last prepare_candidates and its position, for play_candidate
+        # pieces come from the global random module, or from a random.Random of their own with a seed
+        self.rng = None if seed is None else random.Random(seed)
         self._init_game()
-        self.pieces = [[[0,1,0,0],[0,1,0,0],[0,1,0,0],[0,1,0,0]], # line
-                                [[1,1], [1,1]], # square
-                                [[0,1,0], [1,1,0], [0,1,0]], # t shaped
-                                [[0,0,1], [0,1,1], [0,1,0]], # S shaped
-                                [[1,0,0], [1,1,0], [0,1,0]], # Reversed S
-                                [[0,1,0], [0,1,0], [0,1,1]], # L 
-                                [[0,1,0], [0,1,0], [1,1,0]], # Reversed L
-                                ]
+        self.pieces = PIECES
 
         self.x = 6
         self.y = 0
 
-        self.cur_piece_index = random.randint(0, len(self.pieces)-1)
-        self.cur_piece = np.array(self.pieces[self.cur_piece_index])
-        self.next_piece_index = random.randint(0, len(self.pieces)-1)
+        self.cur_piece_index = self._random_piece()
+        self.set_rotation(0)
+        self.next_piece_index = self._random_piece()
         self.next_piece = np.array(self.pieces[self.next_piece_index])
 
         self.full_rows_rewards = {0: 0, 1: 40, 2: 100, 3: 300, 4: 1200}
@@ -45,7 +56,33 @@ class Tetris:
         self.board.append([1 for _ in range(14)]) # padding down
         self.board.append([1 for _ in range(14)]) # padding down
         self.board = np.array(self.board)
+        self.hash = _board_hash(self.board)
+        self._count_blocks()
         self.done = False
+        self.lines = 0 # cleared by do_move
+        self.moves = [] # undo records of apply_move
+
+    def _count_blocks(self):
+        # blocks per row and height per column of the playfield (columns 2-11), from then on
+        # _insert_piece, _remove_piece and clear_up_lines keep them up to date
+        self.row_fill = np.count_nonzero(self.board[:, 2:12], axis=1).tolist()
+        self._count_heights()
+
+    def _count_heights(self):
+        filled = self.board[:20, 2:12] != 0
+        self.heights = np.where(filled.any(axis=0), 20 - filled.argmax(axis=0), 0).tolist()
+
+    def set_board(self, board):
+        self.board = board
+        self.hash = _board_hash(board)
+        self._count_blocks()
+
+    def _random_piece(self):
+        return (random if self.rng is None else self.rng).randint(0, len(self.pieces)-1)
+
+    def set_rotation(self, rot):
+        self.rot = rot
+        self.cur_piece = ROTATIONS[self.cur_piece_index][rot].matrix
 
     def _insert_piece(self, x = None, y = None, val = 1):
         if x is None:
@@ -53,12 +90,17 @@ class Tetris:
         if y is None:
             y = self.y
 
-        for row in range(len(self.cur_piece)):
-            for col in range(len(self.cur_piece[0])):
-                # self.board[y+row][x+col] ^= self.cur_piece[row][col]
-                if self.cur_piece[row][col] == 1:
-                    self.board[y + row][x + col] = val
-                    
+        cells = ROTATIONS[self.cur_piece_index][self.rot].cells
+        rows, cols = y + cells[:, 0], x + cells[:, 1]
+        changed = self.board[rows, cols] == 0
+        self.hash ^= int(np.bitwise_xor.reduce(ZOBRIST[rows[changed], cols[changed]]))
+        self.board[rows, cols] = val
+
+        heights = self.heights
+        for row, col in zip(rows[changed].tolist(), cols[changed].tolist()):
+            self.row_fill[row] += 1
+            if heights[col - 2] < 20 - row:
+                heights[col - 2] = 20 - row
 
     def _remove_piece(self, x = None, y = None):
         if x is None:
@@ -66,17 +108,21 @@ class Tetris:
         if y is None:
             y = self.y
 
-        for row in range(len(self.cur_piece)):
-            for col in range(len(self.cur_piece[0])):
-                if self.cur_piece[row][col] == 1 and self.board[y + row][x + col] > 0: # because it can be 1 or 2
-                    self.board[y + row][x + col] = 0
-
-    def reset(self):
-        for col in range(2, 12):
-            for row in range(20):
-                self.board[row][col] = 0
+        cells = ROTATIONS[self.cur_piece_index][self.rot].cells
+        rows, cols = y + cells[:, 0], x + cells[:, 1]
+        changed = self.board[rows, cols] != 0
+        self.hash ^= int(np.bitwise_xor.reduce(ZOBRIST[rows[changed], cols[changed]]))
+        self.board[rows, cols] = 0
 
+        heights = self.heights
+        for row, col in zip(rows[changed].tolist(), cols[changed].tolist()):
+            self.row_fill[row] -= 1
+            if heights[col - 2] == 20 - row:
+                # the top of the column went, look for the next block down
+                below = np.flatnonzero(self.board[row:20, col])
+                heights[col - 2] = 20 - row - int(below[0]) if len(below) else 0
 
+    def reset(self):
         self._init_game()
 
         return self.grade_board(False)
@@ -104,21 +150,21 @@ class Tetris:
         return Hit.NO_HIT
 
     def clear_up_lines(self):
-        row = len(self.board) - 3
-        while row != 0:
-            isRowFull = True 
-            for col in range(1, len(self.board[row]) - 1):
-                if self.board[row][col] == 0:
-                    isRowFull = False 
-
-            if isRowFull:
-                for row_idx in range(row, 0, -1):
-                    for col in range(1, len(self.board[row_idx]) - 1):
-                        self.board[row_idx][col] = self.board[row_idx - 1][col]
-                row += 1
-
-            row -= 1
-                
+        # row 0 is never checked and its contents fill the rows freed at the top
+        full = [row for row in range(1, 20) if self.row_fill[row] == 10]
+        if not full:
+            return
+
+        keep = [row for row in range(1, 20) if self.row_fill[row] != 10]
+        cleared = len(full)
+        self.board[1 + cleared:20] = self.board[keep]
+        self.board[1:1 + cleared] = self.board[0]
+        self.row_fill[1:20] = [self.row_fill[0]] * cleared + [self.row_fill[row] for row in keep]
+        self._count_heights()
+
+        # every shifted row changes, so hash the board again
+        self.hash = _board_hash(self.board)
+
     def can_rotate(self, x = None, y = None):
         if x is None:
             x = self.x
@@ -129,11 +175,11 @@ class Tetris:
             return False
 
         did_rotate = True
-        self.old_piece = self.cur_piece
+        old_rot = self.rot
         self._remove_piece(x, y)
-        self.cur_piece = np.rot90(self.cur_piece, -1)
+        self.set_rotation((self.rot + 1) % 4)
         if self.can_draw(x, y, Hit.ALL) != Hit.NO_HIT:
-            self.cur_piece = self.old_piece
+            self.set_rotation(old_rot)
             did_rotate = False
 
         self._insert_piece(x, y)
@@ -190,257 +236,277 @@ class Tetris:
         self.y = 0
 
         self.cur_piece_index = self.next_piece_index
-        self.cur_piece = np.array(self.pieces[self.cur_piece_index])
-        self.next_piece_index = random.randint(0, len(self.pieces)-1)
+        self.set_rotation(0)
+        self.next_piece_index = self._random_piece()
         self.next_piece = np.array(self.pieces[self.next_piece_index])
 
-    def _max_line_height(self):
-        max_line_height = 0
+    def piece_state(self):
+        # reset() keeps the falling and next piece of the last game, so they are part of what a resumed training needs
+        rng = None if self.rng is None else self.rng.getstate()
+        return (self.cur_piece_index, self.next_piece_index, self.x, self.y, self.rot, rng)
+
+    def set_piece_state(self, state):
+        # the board is not touched, meant to be followed by reset()
+        self.cur_piece_index, self.next_piece_index, self.x, self.y, rot, rng = state
+        self.set_rotation(rot)
+        if rng is not None:
+            self.rng = random.Random()
+            self.rng.setstate(rng)
+        self.next_piece = np.array(self.pieces[self.next_piece_index])
 
-        for i in range(2, 12):
-            for j in range(20):
-                if self.board[j][i] == 1:
-                    max_line_height = max(max_line_height, 20 - j)
+    def snapshot(self):
+        return TetrisState(self._packed_rows(), self.cur_piece_index, self.next_piece_index,
+                           self.x, self.y, self.rot, self.done, self.lines)
+
+    def restore(self, state):
+        '''
+        Goes back to a snapshot, writing into the board that is already there. The undo stack is dropped.
+        '''
+        self._unpack_rows(state.rows)
+        self.cur_piece_index, self.next_piece_index = state.piece, state.next_piece
+        self.x, self.y = state.x, state.y
+        self.set_rotation(state.rot)
+        self.next_piece = np.array(self.pieces[self.next_piece_index])
+        self.done = state.done
+        self.lines = state.lines
+        self.moves = []
+
+    def _packed_rows(self):
+        return tuple(((self.board != 0) @ ROW_BITS).tolist())
+
+    def _unpack_rows(self, rows):
+        self.board[:] = (np.array(rows)[:, None] >> np.arange(14)) & 1
+        self.hash = _board_hash(self.board)
+        self._count_blocks()
+
+    def clone(self):
+        '''
+        An independent copy of the game, with a copy of its random generator. The candidate cache is shared.
+        '''
+        game = copy.copy(self)
+        game._copy_state()
+        return game
+
+    def _copy_state(self):
+        # what clone() must not share
+        self.board = self.board.copy()
+        self.row_fill = list(self.row_fill)
+        self.heights = list(self.heights)
+        self.rng = copy.deepcopy(self.rng)
+        self.moves = list(self.moves)
+
+    def apply_move(self, x, y, rotation):
+        '''
+        do_move that undo_move can take back. Only the rows from the top down to the lowest one the move
+        touches are saved (nothing below the falling piece and the placement can change).
+        '''
+        old = ROTATIONS[self.cur_piece_index][self.rot].cells
+        new = ROTATIONS[self.cur_piece_index][(self.rot + rotation) % 4].cells
+        bottom = max(self.y + int(old[-1, 0]), y + int(new[-1, 0])) + 1
+
+        rng = random if self.rng is None else self.rng
+        self.moves.append((
+            self._save_rows(bottom), rng.getstate(), self.done, self.lines,
+            self.cur_piece_index, self.next_piece_index, self.next_piece, self.x, self.y, self.rot,
+        ))
+        return self.do_move(x, y, rotation)
+
+    def undo_move(self):
+        rows, rng, self.done, self.lines, self.cur_piece_index, self.next_piece_index, self.next_piece, \
+            self.x, self.y, rot = self.moves.pop()
+        self._load_rows(rows)
+        (random if self.rng is None else self.rng).setstate(rng)
+        self.set_rotation(rot)
+
+    def _save_rows(self, bottom):
+        return (self.board[:bottom].copy(), list(self.row_fill), list(self.heights), self.hash)
+
+    def _load_rows(self, saved):
+        rows, self.row_fill, self.heights, self.hash = saved
+        self.board[:len(rows)] = rows
 
-        return max_line_height
+    def _max_line_height(self):
+        return max(self.heights)
 
     def _full_rows(self):
-        rows_cleared = 0
-        for i in range(20):
-            clear = True
-            for j in range(len(self.board[i])):
-                if self.board[i][j] == 0:
-                    clear = False
-        
-            if clear:
-                rows_cleared += 1
-            
-        return rows_cleared
-
-    def _holes(self):
-        holes = 0
-        open_holes = 0
-
-        for j in range(2, 12):
-            blocks_found = False
-            for i in range(20):
-                if self.board[i][j] == 1:
-                    blocks_found = True
-                elif blocks_found:
-                    if self.board[i][j - 1] == 0 and self.board[i][j - 2] == 0:
-                        open_holes += 1
-                        continue
-
-                    if self.board[i][j + 1] == 0 and self.board[i][j + 2] == 0:
-                        open_holes += 1
-                        continue
-                    holes += 1
-                
-        return holes, open_holes
-
-    def _row_transitions(self):
-        row = 0
-
-        for i in range(20):
-            for j in range(2, 12):
-                if self.board[i][j] == 1 and self.board[i][j - 1] == 0:
-                    row += 1
-                if self.board[i][j] == 1 and self.board[i][j + 1] == 0:
-                    row += 1
-        return row
-
-    def _col_transitions(self):
-        col = 0
-
-        for j in range(2, 12):
-            for i in range(20):
-                if self.board[i][j] == 1 and self.board[i - 1][j] == 0:
-                    col += 1
-                if self.board[i][j] == 1 and self.board[i + 1][j] == 0:
-                    col += 1
-
-        return col
-
-    # bumpiness is defined as the total difference between column heights
-    def _bumpiness(self):
-        bumpiness = 0
-        previous_height = None 
-
-        for i in range(2, 12):
-            curr = 0
-            for j in range(20):
-                if self.board[j][i] == 1:
-                    curr = 20 - j
-                    break
-
-            if previous_height is not None:
-                bumpiness += abs(previous_height - curr)
-
-            previous_height = curr
-
-        return bumpiness
-
-    def _total_height(self):
-        total_height = 0
-        for j in range(2, 12):
-            for i in range(20):
-                if self.board[i][j] == 1:
-                    total_height += 20 - i
-                    break
-        return total_height
+        return self.row_fill[:20].count(10)
 
     def grade_board(self, calculate=True):
-        # features at: https://inria.hal.science/hal-00926213/document page 4 + some of mine
-        holes, open_holes = self._holes()
-        bumpiness = self._bumpiness()
-        row_transitions = self._row_transitions()
-        col_transitions = self._col_transitions()
-        max_height = self._max_line_height()
-        full_rows = self._full_rows()
+        features = board_features(self.board)
 
         if calculate:
-            score = (
-                - 80.0 * holes
-                - 20.0 * open_holes
-                - 8.0 * bumpiness
-                - 9.0 * row_transitions
-                - 7.0 * col_transitions
-                - 25.0 * max_height
-                + 500.0 * full_rows
-            )
-
-            return score
-        return (holes, open_holes, bumpiness, row_transitions, col_transitions, max_height, full_rows)
+            return heuristic_score(features)
+        return tuple(features.astype(int).tolist())
 
     def is_done(self):
         if self._max_line_height() > 16:
             self.done = True
         return self.done
 
-    def every_possible_end_move(self, orig_x, orig_y, calculate=True):
-        end_moves = []
-
-        status = [[BFS_STATUS.DIDNT_VISIT for _ in range(14)] for _ in range(23)]
-        q = Queue()
-        x, y = orig_x, orig_y
-        q.put((x, y))
-        status[y][x] = BFS_STATUS.VISIT
-        while not q.empty():
-            x, y = q.get()
-
-            if self.can_draw(x, y, Hit.DOWN) == Hit.NO_HIT and status[y + 1][x] == BFS_STATUS.DIDNT_VISIT:
-                q.put((x, y + 1))
-                status[y + 1][x] = BFS_STATUS.VISIT
-            if self.can_draw(x, y, Hit.LEFT) == Hit.NO_HIT and status[y][x - 1] == BFS_STATUS.DIDNT_VISIT:
-                q.put((x - 1, y))
-                status[y][x - 1] = BFS_STATUS.VISIT
-            if self.can_draw(x, y, Hit.RIGHT) == Hit.NO_HIT and status[y][x + 1] == BFS_STATUS.DIDNT_VISIT:
-                q.put((x + 1, y))
-                status[y][x + 1] = BFS_STATUS.VISIT
-
-            if self.can_draw(x, y, Hit.DOWN) == Hit.DOWN:
-                prev_board = self.board.copy()
-                self._insert_piece(x, y)
-                self.clear_up_lines()
-                end_moves.append((x, y, self.grade_board(calculate)))
-                self.board = prev_board
-                
-            status[y][x] = BFS_STATUS.FINISHED
+    def _grade_placements(self, board, placements, calculate):
+        features = board_features(place_pieces(board, self.cur_piece_index, placements))
+        if calculate:
+            grades = heuristic_score(features).tolist()
+        else:
+            grades = [tuple(row) for row in features.astype(int).tolist()]
 
-        return end_moves
+        return [(x, y, grade) for (x, y, _), grade in zip(placements.tolist(), grades)]
+
+    def every_possible_end_move(self, orig_x, orig_y, calculate=True):
+        placements = reachable_placements(self.board, self.cur_piece_index, orig_x, orig_y, (self.rot,))
+        return self._grade_placements(self.board, placements, calculate)
 
     def next(self):
         self.clear_up_lines()
         self.new_next_piece()
         self._insert_piece()
 
+    def board_key(self):
+        return self.hash
+
     def graded_moves(self, calculate=True):
-        # SAVE STATE
-        saved_board = self.board.copy()
-        saved_piece = self.cur_piece.copy()
-        saved_x, saved_y = self.x, self.y
-        saved_index = self.cur_piece_index
+        if self.cache is None:
+            return self._search_moves(calculate)
 
-        orig_x = self.x
-        orig_y = self.y
+        key = (self.board_key(), self.cur_piece_index, self.rot, self.x, self.y, calculate)
+        end_moves = self.cache.get(key)
+        if end_moves is None:
+            end_moves = self._search_moves(calculate)
+            self.cache.put(key, end_moves)
 
-        end_moves = {0: [], 1: [], 2: [], 3: []}
+        # callers are free to change the lists they get
+        return {rot: list(moves) for rot, moves in end_moves.items()}
 
-        # rotation 0
-        self._remove_piece(orig_x, orig_y)
-        end_moves[0] = self.every_possible_end_move(orig_x, orig_y, calculate)
-        self._insert_piece(orig_x, orig_y)
+    def _board_without_piece(self):
+        board = self.board.copy()
+        cells = ROTATIONS[self.cur_piece_index][self.rot].cells
+        board[self.y + cells[:, 0], self.x + cells[:, 1]] = 0
+        return board
 
-        # rotations 1–3
-        for rot in range(1, 4):
-            self._remove_piece(orig_x, orig_y)
-            self.cur_piece = np.rot90(self.cur_piece, -1)
-            end_moves[rot] = self.every_possible_end_move(orig_x, orig_y, calculate)
-            self._insert_piece(orig_x, orig_y)
+    def _search_moves(self, calculate=True):
+        board = self._board_without_piece()
 
-        # RESTORE STATE
-        self.board = saved_board
-        self.cur_piece = saved_piece
-        self.x, self.y = saved_x, saved_y
-        self.cur_piece_index = saved_index
+        end_moves = {0: [], 1: [], 2: [], 3: []}
+
+        # rotations that give the same shape (line, square, S) would only repeat the same placements
+        turns = DISTINCT_ROTATIONS[self.cur_piece_index][self.rot]
+        placements = reachable_placements(board, self.cur_piece_index, self.x, self.y,
+                                          [(self.rot + rot) % 4 for rot in turns])
+        moves = self._grade_placements(board, placements, calculate)
+        for (_, _, rot), move in zip(placements.tolist(), moves):
+            end_moves[(rot - self.rot) % 4].append(move)
 
         return end_moves
     
+    def heuristic_move(self, weights=HEURISTIC_WEIGHTS):
+        '''
+        The move of agent_random_move, the prepare_candidates candidate with the best heuristic_score
+        (with weights), which is added as its "value".
+        '''
+        candidates = self.prepare_candidates()
+        values = heuristic_score(candidates.features, weights)
+        # the first of the best ones, like agent_random_move always picked
+        best = int(values.argmax())
+        return dict(candidates[best], value=float(values[best]))
+
     def agent_random_move(self):
-        orig_x = self.x
-        orig_y = self.y
-
-        self._remove_piece(orig_x, orig_y)
-        end_moves = self.graded_moves()
-        print(end_moves)
-
-        # We assume there has to be at least one move
-        best_move = end_moves[0][0]
-        rotation = 0
-        for rot in range(4):
-            for move in end_moves[rot]:
-                if move[2] > best_move[2]:
-                    best_move = move
-                    rotation = rot
-
-        x, y = best_move[0], best_move[1]
-        for _ in range(rotation):
-            self.cur_piece = np.rot90(self.cur_piece, -1)
+        move = self.heuristic_move()
 
-        self._insert_piece(x, y)
+        self._remove_piece()
+        self.set_rotation((self.rot + move["rot"]) % 4)
+        self._insert_piece(move["x"], move["y"])
+
+        self.next()
+
+    def lookahead_move(self, score=heuristic_score, beam=None):
+        '''
+        The best move of a two ply search over the falling and the next piece (see lookahead.lookahead),
+        as a prepare_candidates candidate. score grades (n, 7) features, beam prunes the first ply.
+        '''
+        placements, features, values = lookahead(self._board_without_piece(), self.cur_piece_index, self.next_piece_index,
+                                                 self.x, self.y, self.rot, score, beam)
+        best = int(values.argmax())
+        x, y, rot = placements[best].tolist()
+        return {"rot": rot, "x": x, "y": y, "features": tuple(features[best].astype(int).tolist())}
+
+    def agent_lookahead_move(self, beam=None):
+        # agent_random_move, looking one piece further
+        move = self.lookahead_move(beam=beam)
+
+        self._remove_piece()
+        self.set_rotation((self.rot + move["rot"]) % 4)
+        self._insert_piece(move["x"], move["y"])
 
         self.next()
 
     def prepare_candidates(self):
-        moves_dict = self.graded_moves(False)
-        candidates = []
-        for rot in range(4):
-            for move in moves_dict[rot]:
-                candidates.append({"rot": rot, "x": move[0], "y": move[1], "features" : move[2]})
+        '''
+        Every move of the falling piece as a CandidateSet, play_candidate(i) then plays its i-th move.
+        '''
+        key = self._candidates_key()
+        if self.cache is None:
+            candidates = self._candidate_set()
+        else:
+            candidates = self.cache.get(key)
+            if candidates is None:
+                candidates = self._candidate_set()
+                self.cache.put(key, candidates)
 
+        self.candidates = (candidates, key)
         return candidates
 
+    def _candidates_key(self):
+        # the position a CandidateSet is for, with the falling piece on the board
+        return (self.board_key(), self.cur_piece_index, self.rot, self.x, self.y, "candidates")
+
+    def _candidate_set(self):
+        board = self._board_without_piece()
+        turns = DISTINCT_ROTATIONS[self.cur_piece_index][self.rot]
+        placements = reachable_placements(board, self.cur_piece_index, self.x, self.y,
+                                          [(self.rot + rot) % 4 for rot in turns])
+        return CandidateSet(board, self.cur_piece_index, placements, self.rot)
+
     def do_move(self, x, y, rotation):
+        reward = self._drop_piece(x, y, rotation)
+        grade = self.grade_board(False)
+        self.new_next_piece()
+        self._insert_piece()
+
+        return (grade, reward, self.done)
+
+    def play_candidate(self, index):
+        '''
+        do_move of the move of index `index` in the CandidateSet of the last prepare_candidates, whose features
+        are the returned state instead of a new grade_board. The set must be of the current position.
+        '''
+        candidates, key = self.candidates
+        if candidates is None or key != self._candidates_key():
+            raise ValueError("the candidates are not of the current position, call prepare_candidates first")
+
+        reward = self._drop_piece(*candidates.move(index))
+        grade = tuple(candidates.features_of(index).astype(int).tolist())
+        self.new_next_piece()
+        self._insert_piece()
+
+        return (grade, reward, self.done)
+
+    def _drop_piece(self, x, y, rotation):
+        # the falling piece to its place and the full lines cleared, returns the reward
         self._remove_piece()
         
         # Since only the model will use this function and the moves are legal we don't have to check the validtiy of the moves
-        for _ in range(rotation):
-            self.cur_piece = np.rot90(self.cur_piece, -1)
+        self.set_rotation((self.rot + rotation) % 4)
 
         self._insert_piece(x, y)
 
+        full_rows = self._full_rows()
+        self.lines += full_rows
         if self.is_done():
             # -5 for dying
             reward = -5
         else:
             # + 1 for staying alive
-            reward = self.full_rows_rewards[self._full_rows()] + 1
+            reward = self.full_rows_rewards[full_rows] + 1
 
         self.clear_up_lines()
-        grade = self.grade_board(False)
-        self.new_next_piece()
-        self._insert_piece()
-
-        return (grade, reward, self.done)
-
-
+        return reward
@@ -0,0 +1,152 @@
+import json
+import os
+import numpy as np
+from features import FEATURES, HEURISTIC_WEIGHTS
+from games import game_pool, play_games
+
+'''
+Cross-entropy search over the weights of heuristic_score (https://inria.hal.science/hal-00926213/document):
+every generation samples a population of weight vectors from a normal distribution, plays the same seeded
+games with each of them on a pool of processes and refits the distribution to the best ones.
+'''
+
+# full_rows is always 0 on the boards the agent grades (lines are cleared first), its weight is left as it is
+PINNED = (FEATURES.index("full_rows"),)
+# the best sample of every generation also plays the games VALIDATION_SEED + seed, ..., the same every
+# generation, and the best of those scores is the best weights of the search
+VALIDATION_SEED = 1_000_000
+
+
+def play_game(engine, weights, seed, max_lines):
+    '''
+    Lines cleared by the heuristic agent with weights in the game engine(seed=seed), stopped at max_lines.
+    '''
+    game = engine(seed=seed)
+    game.reset()
+
+    while not game.done and game.lines < max_lines:
+        move = game.heuristic_move(weights)
+        game.do_move(move["x"], move["y"], move["rot"])
+
+    return min(game.lines, max_lines)
+
+
+class CrossEntropySearch:
+    '''
+    Normal distribution over the weights (mean, std per weight) refit every generation to the elite fraction
+    of population samples, with noise added to the variance so it does not collapse too early. The pinned
+    weights keep their value. state_dict() is everything needed to go on from the last generation, see save/load.
+    '''
+    def __init__(self, mean=HEURISTIC_WEIGHTS, std=None, population=50, elite=0.2, noise=4.0, pinned=PINNED, seed=0):
+        self.mean = np.array(mean, dtype=np.float64)
+        self.std = np.abs(self.mean) / 2 if std is None else np.array(std, dtype=np.float64)
+        self.free = np.ones(len(self.mean), dtype=bool)
+        self.free[list(pinned)] = False
+        self.std[~self.free] = 0
+        self.population = population
+        self.elite = max(1, int(population * elite))
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+        self.generation = 0
+        self.best_weights = self.mean.copy()
+        self.best_score = None # on the validation games
+        self.history = [] # per generation: mean, std, mean and best score of the samples, validation score
+
+    def sample(self):
+        return self.mean + self.std * self.rng.standard_normal((self.population, len(self.mean)))
+
+    def update(self, samples, scores):
+        '''
+        Refits the distribution to the samples' scores, returns the best sample.
+        '''
+        order = np.argsort(-scores, kind="stable")
+        elite = samples[order[:self.elite]]
+        self.mean[self.free] = elite.mean(axis=0)[self.free]
+        self.std[self.free] = np.sqrt(elite.var(axis=0) + self.noise)[self.free]
+
+        self.generation += 1
+        self.history.append({
+            "generation": self.generation,
+            "mean": self.mean.tolist(),
+            "std": self.std.tolist(),
+            "mean_score": float(scores.mean()),
+            "best_score": float(scores[order[0]]),
+        })
+        return samples[order[0]]
+
+    def validated(self, weights, score):
+        # the validation score of this generation's best sample
+        self.history[-1]["validation_score"] = score
+        if self.best_score is None or score > self.best_score:
+            self.best_score = score
+            self.best_weights = np.array(weights, dtype=np.float64)
+
+    def state_dict(self):
+        return {
+            "features": list(FEATURES),
+            "generation": self.generation,
+            "mean": self.mean.tolist(),
+            "std": self.std.tolist(),
+            "free": self.free.tolist(),
+            "population": self.population,
+            "elite": self.elite,
+            "noise": self.noise,
+            "best_weights": self.best_weights.tolist(),
+            "best_score": self.best_score,
+            "history": self.history,
+            "rng": self.rng.bit_generator.state,
+        }
+
+    def load_state_dict(self, state):
+        self.generation = state["generation"]
+        self.mean = np.array(state["mean"])
+        self.std = np.array(state["std"])
+        self.free = np.array(state["free"])
+        self.population = state["population"]
+        self.elite = state["elite"]
+        self.noise = state["noise"]
+        self.best_weights = np.array(state["best_weights"])
+        self.best_score = state["best_score"]
+        self.history = state["history"]
+        self.rng.bit_generator.state = state["rng"]
+
+    def save(self, path):
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.state_dict(), f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def load(self, path):
+        with open(path) as f:
+            self.load_state_dict(json.load(f))
+
+
+def tune(engine, generations=20, population=50, games=5, max_lines=1000, seed=0, workers=None, path="tune.json", resume=False):
+    '''
+    Runs the search up to generations, saving it to path after every generation (resume goes on from there).
+    Every sample of generation g plays the games seed + g * games, ... so they are all graded on the same pieces,
+    the best one is then compared to the ones of the other generations on the validation games.
+    Returns the search.
+    '''
+    search = CrossEntropySearch(population=population, seed=seed)
+    if resume:
+        search.load(path)
+    validation = VALIDATION_SEED + seed + np.arange(games)
+
+    with game_pool(workers) as pool:
+        while search.generation < generations:
+            samples = search.sample()
+            seeds = seed + search.generation * games + np.arange(games)
+            jobs = [(engine, weights, int(game_seed), max_lines) for weights in samples for game_seed in seeds]
+            lines = np.array(play_games(play_game, jobs, pool=pool), dtype=np.float64).reshape(len(samples), games)
+            best = search.update(samples, lines.mean(axis=1))
+
+            jobs = [(engine, best, int(game_seed), max_lines) for game_seed in validation]
+            search.validated(best, float(np.mean(play_games(play_game, jobs, pool=pool))))
+            search.save(path)
+
+            last = search.history[-1]
+            print(f"Generation {search.generation}: mean {last['mean_score']:.1f} lines, best {last['best_score']:.1f}, "
+                  f"validation {last['validation_score']:.1f}, weights {np.round(search.mean, 1).tolist()}")
+
+    return search
@@ -0,0 +1,100 @@
+import numpy as np
+from features import board_features
+from pieces import PIECES, DISTINCT_ROTATIONS
+from placements import reachable_placements, drop_pieces, clear_lines
+
+SPAWN_X = 6
+SPAWN_Y = 0
+FULL_ROWS_REWARDS = np.array([0, 40, 100, 300, 1200])
+
+
+def _empty_board():
+    board = np.zeros((22, 14), dtype=np.int8)
+    board[:, [0, 1, 12, 13]] = 1
+    board[20:] = 1 # padding down
+    return board
+
+
+EMPTY_BOARD = _empty_board()
+
+
+class VecTetris:
+    '''
+    n games of Tetris stepped together. The boards live in one (n, 22, 14) array without the falling
+    piece, and every step scores the candidates of all the games in a single board_features call.
+    The rules and rewards are the same as Tetris.do_move, and finished games restart right away.
+    '''
+    def __init__(self, n, seed=None):
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+
+        self.boards = np.repeat(EMPTY_BOARD[None], n, axis=0)
+        self.cur_pieces = self.rng.integers(0, len(PIECES), n)
+        self.next_pieces = self.rng.integers(0, len(PIECES), n)
+        self.done = np.zeros(n, dtype=bool)
+
+        self._candidates = None
+
+    def reset(self):
+        self.boards[:] = EMPTY_BOARD
+        self.done[:] = False
+        self._candidates = None
+
+        return np.zeros((self.n, 7), dtype=np.float32)
+
+    def prepare_candidates(self):
+        '''
+        Returns (features, offsets): the (m, 7) float32 features of every candidate placement of every game,
+        where the candidates of game i are rows offsets[i]:offsets[i + 1].
+        '''
+        found = []
+        for env in range(self.n):
+            piece = self.cur_pieces[env]
+            found.append(reachable_placements(self.boards[env], piece, SPAWN_X, SPAWN_Y, DISTINCT_ROTATIONS[piece][0]))
+
+        counts = np.array([len(placements) for placements in found])
+        offsets = np.zeros(self.n + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        placements = np.concatenate(found)
+        owners = np.repeat(np.arange(self.n), counts)
+
+        boards = self.boards[owners]
+        drop_pieces(boards, self.cur_pieces[owners], placements)
+        # Tetris.do_move looks at the height and the full rows before they are cleared
+        filled = boards[:, :20, 2:12] == 1
+        rows_with_blocks = filled.any(axis=2)
+        heights = np.where(rows_with_blocks.any(axis=1), 20 - rows_with_blocks.argmax(axis=1), 0)
+        full_rows = (boards[:, :20] != 0).all(axis=2).sum(axis=1)
+        clear_lines(boards)
+        features = board_features(boards)
+
+        self._candidates = (placements, offsets, boards, features, heights, full_rows)
+        return features, offsets
+
+    def placements(self):
+        '''
+        The (m, 3) array of (x, y, rot) of the candidates from the last prepare_candidates.
+        '''
+        return self._candidates[0]
+
+    def do_move(self, actions):
+        '''
+        actions[i] is the index of the chosen candidate of game i, counted from offsets[i].
+        Returns (features, rewards, dones). The features of a finished game are of its last board,
+        and the game is already reset, so its next state is the empty board (all zero features).
+        '''
+        placements, offsets, boards, features, heights, full_rows = self._candidates
+        chosen = offsets[:-1] + np.asarray(actions)
+
+        self.boards[:] = boards[chosen]
+        dones = heights[chosen] > 16
+        # -5 for dying, + 1 for staying alive
+        rewards = np.where(dones, -5, FULL_ROWS_REWARDS[full_rows[chosen]] + 1)
+
+        self.cur_pieces = self.next_pieces
+        self.next_pieces = self.rng.integers(0, len(PIECES), self.n)
+        self.boards[dones] = EMPTY_BOARD
+        self.done = dones
+        self._candidates = None
+
+        return features[chosen], rewards, dones
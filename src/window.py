@@ -1,17 +1,69 @@
-from ai.tetris_network import TetrisNetwork
 from tetris import Tetris, Hit
 import pygame
 import numpy as np
+import os
+import queue
+import threading
+
+THOUGHTEVENT = pygame.USEREVENT+3 # a result of the AgentWorker
+
+
+class AgentWorker:
+    '''
+    Runs the agent's thinking on a background thread and posts every result as a THOUGHTEVENT
+    (event.kind, event.result, event.error), so the window keeps drawing and reading input meanwhile.
+    One job at a time, busy until its event is handled with done().
+    '''
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.busy = False
+        self.thread = threading.Thread(target=self._run, name="agent-worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, function, *args):
+        self.busy = True
+        self.jobs.put((kind, function, args))
+
+    def done(self, event):
+        self.busy = False
+        if event.error is not None:
+            raise event.error
+        return event.result
+
+    def close(self):
+        # lets the job in progress post its event before pygame quits
+        self.jobs.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            kind, function, args = job
+            result, error = None, None
+            try:
+                result = function(*args)
+            except Exception as exception:
+                error = exception
+            pygame.event.post(pygame.event.Event(THOUGHTEVENT, kind=kind, result=result, error=error))
 
 
 class Window:
-    def __init__(self, ai=False, DEBUG=False):
+    def __init__(self, ai=False, DEBUG=False, engine=Tetris, fast_forward=False, lookahead=False, beam=None):
         self.RES = (1000,1000)
-        self.game_agent = Tetris()
+        self.game_agent = engine()
         self.AGENT = (50, 450) # where the board starts and ends
 
         self.ai = ai
-        self.tetris_network = TetrisNetwork(self.game_agent, True, 0.05)
+        if ai:
+            from ai.numpy_network import NumpyPolicy, export_npz
+            if os.path.exists("network") and (not os.path.exists("network.npz")
+                                              or os.path.getmtime("network") > os.path.getmtime("network.npz")):
+                # the torch checkpoint was never exported or was trained since, convert it again
+                import torch
+                export_npz(torch.load("network", map_location="cpu", weights_only=True), "network.npz")
+            self.tetris_network = NumpyPolicy(self.game_agent, "network.npz", 0.05)
 
         self.game_player = Tetris()
         self.PLAYER = (550, 950) # where the board starts and ends
@@ -21,7 +73,16 @@ class Window:
         self.HEIGHT = 100 # we'll start at y=100 up to y=900
 
         self.DEBUG = DEBUG
+        # the agent moves as soon as the last move is computed instead of every second
+        self.fast_forward = fast_forward and not DEBUG
+        # the agent also looks at the next piece, beam prunes its first ply
+        self.lookahead = lookahead
+        self.beam = beam
 
+        self.worker = AgentWorker()
+        self.end_moves = None
+        self.rotation = 0
+        self.debug_piece = None # (x, y) of the DEBUG move being shown
 
         pygame.init()
         pygame.font.init()
@@ -29,47 +90,145 @@ class Window:
         self.screen = pygame.display.set_mode(self.RES)
         self.clock = pygame.time.Clock()
 
+        # frames only blit the cells that changed over the cached background, see draw_game
+        self.sprites = self._cell_sprites()
+        self.background = pygame.Surface(self.RES).convert()
+        self.background.fill("white")
+        self.draw_text(self.background)
+        self.drawn = {}
+
+    def _cell_sprites(self):
+        # one pre-rendered cell per look: empty (outline), red block and green block
+        sprites = []
+        for color, width in (((0,0,0), 1), ((255,0,0), 0), ((0,255,0), 0)):
+            sprite = pygame.Surface((self.BLOCK_SIZE, self.BLOCK_SIZE)).convert()
+            sprite.fill("white")
+            pygame.draw.rect(sprite, color, (0, 0, self.BLOCK_SIZE, self.BLOCK_SIZE), width)
+            sprites.append(sprite)
+        return sprites
+
+    def _cell_looks(self, board, agent):
+        # index of the sprite of every visible cell, on the agent board 2 is drawn green
+        cells = np.asarray(board)[:20, 2:12]
+        looks = (cells != 0).astype(np.int8)
+        if agent:
+            looks[cells == 2] = 2
+        return looks
+
+    def redraw(self):
+        # everything, from the background, e.g. when the window was uncovered
+        self.screen.blit(self.background, (0, 0))
+        self.drawn = {self.AGENT[0]: None, self.PLAYER[0]: None}
+        self.draw_game()
+        pygame.display.flip()
+
     def draw_game(self):
-        for row in range(len(self.game_agent.board) - 2):
-            for col in range(2, len(self.game_agent.board[0]) - 2):
-                # Agent Board
-                if self.game_agent.board[row][col] == 0:
-                    pygame.draw.rect(self.screen, (0,0,0), (self.AGENT[0] + self.BLOCK_SIZE*(col-2), self.HEIGHT + self.BLOCK_SIZE*row, self.BLOCK_SIZE, self.BLOCK_SIZE), 1)
-                elif self.game_agent.board[row][col] == 2:
-                    pygame.draw.rect(self.screen, (0,255,0), (self.AGENT[0] + self.BLOCK_SIZE*(col-2), self.HEIGHT + self.BLOCK_SIZE*row, self.BLOCK_SIZE, self.BLOCK_SIZE), 0)
-                else:
-                    pygame.draw.rect(self.screen, (255,0,0), (self.AGENT[0] + self.BLOCK_SIZE*(col-2), self.HEIGHT + self.BLOCK_SIZE*row, self.BLOCK_SIZE, self.BLOCK_SIZE), 0)
-
-                # Player board
-                if self.game_player.board[row][col] == 0:
-                    pygame.draw.rect(self.screen, (0,0,0), (self.PLAYER[0] + self.BLOCK_SIZE*(col-2), self.HEIGHT + self.BLOCK_SIZE*row, self.BLOCK_SIZE, self.BLOCK_SIZE), 1)
-                else:
-                    pygame.draw.rect(self.screen, (255,0,0), (self.PLAYER[0] + self.BLOCK_SIZE*(col-2), self.HEIGHT + self.BLOCK_SIZE*row, self.BLOCK_SIZE, self.BLOCK_SIZE), 0)
-    
-    def draw_text(self):
+        '''
+        Blits the cells that changed since the last frame, returns their rects for pygame.display.update.
+        '''
+        dirty = []
+        for left, board, agent in ((self.AGENT[0], self.game_agent.board, True), (self.PLAYER[0], self.game_player.board, False)):
+            looks = self._cell_looks(board, agent)
+            last = self.drawn[left]
+            if last is None:
+                rows, cols = np.indices(looks.shape).reshape(2, -1)
+            else:
+                rows, cols = np.nonzero(looks != last)
+            self.drawn[left] = looks
+
+            for row, col in zip(rows.tolist(), cols.tolist()):
+                position = (left + self.BLOCK_SIZE*col, self.HEIGHT + self.BLOCK_SIZE*row)
+                dirty.append(self.screen.blit(self.sprites[looks[row, col]], position))
+        return dirty
+
+    def draw_text(self, surface):
         agent_text = self.font.render("Agent", True, (0,0,0))
         player_text = self.font.render("Player", True, (0,0,0))
-        self.screen.blit(agent_text, ((self.AGENT[1] - self.AGENT[0]) / 2, 50))
-        self.screen.blit(player_text, ((self.PLAYER[1] - self.PLAYER[0]) / 2 + 500, 50))
-                
+        surface.blit(agent_text, ((self.AGENT[1] - self.AGENT[0]) / 2, 50))
+        surface.blit(player_text, ((self.PLAYER[1] - self.PLAYER[0]) / 2 + 500, 50))
+
+    def _snapshot(self):
+        # a copy of the agent's game for the worker, the candidate cache stays shared (only the worker uses it)
+        return self.game_agent.clone()
+
+    def _play_move(self, game):
+        if self.lookahead:
+            if self.ai:
+                action = game.lookahead_move(self.tetris_network.network, self.beam)
+                game.do_move(action["x"], action["y"], action["rot"])
+            else:
+                game.agent_lookahead_move(self.beam)
+        elif self.ai:
+            candidates = game.prepare_candidates()
+            game.play_candidate(self.tetris_network.select_action(candidates))
+        else:
+            game.agent_random_move()
+        return game
+
+    def _search_moves(self, game):
+        game._remove_piece()
+        return game.graded_moves()
+
+    def _think(self):
+        if self.DEBUG and self.end_moves is None:
+            self.worker.submit("moves", self._search_moves, self._snapshot())
+        elif self.DEBUG:
+            self._debug_step()
+        else:
+            self.worker.submit("move", self._play_move, self._snapshot())
+
+    def _thought(self, event):
+        result = self.worker.done(event)
+        if event.kind == "moves":
+            self.game_agent._remove_piece()
+            self.end_moves = result
+            print(self.end_moves)
+            self.rotation = 0
+            self._debug_step()
+        else:
+            self.game_agent = result
+            if self.ai:
+                self.tetris_network.env = result
+            if self.fast_forward:
+                self._think()
+
+    def _debug_step(self):
+        # shows the next of the graded moves, after the last one the agent makes its move
+        while self.rotation < 4 and (self.rotation not in self.end_moves or not self.end_moves[self.rotation]):
+            self.rotation += 1
+
+        if self.rotation < 4:
+            x, y, grade = self.end_moves[self.rotation].pop(0)
+            print(f"({self.rotation}) {x}, {y} : {grade}")
+            self.game_agent.set_rotation(self.rotation)
+            self.debug_piece = (x, y)
+        else:
+            print("Finished all possible moves")
+            self.end_moves = None
+            self.debug_piece = None
+
+            self.worker.submit("move", self._play_move, self._snapshot())
+
     def start(self):
         running = True
         MOVEEVENT, t = pygame.USEREVENT+1, 500
         AGENTEVENT, t2 = pygame.USEREVENT+2, 1000
 
         pygame.time.set_timer(MOVEEVENT, t)
-        pygame.time.set_timer(AGENTEVENT, t2)
+        if self.fast_forward:
+            self._think()
+        else:
+            pygame.time.set_timer(AGENTEVENT, t2)
 
-        end_moves = None
-        rotation = 0
-        x = None
-        y = None
-        
+        self.redraw()
         while running:
-            self.screen.fill("white")
-            for event in pygame.event.get():
+            # the boards only change on events, so sleep until the next one
+            events = [pygame.event.wait()] + pygame.event.get()
+            for event in events:
                 if event.type == pygame.QUIT:
                     running = False
+                if event.type == pygame.WINDOWEXPOSED:
+                    self.redraw()
 
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_SPACE:
@@ -83,46 +242,24 @@ class Window:
 
                 if event.type == MOVEEVENT:
                     self.game_player.move_down_piece()
-                if event.type == AGENTEVENT:
-                    if self.DEBUG:
-                        if end_moves is None:
-                            self.game_agent._remove_piece()
-                            end_moves = self.game_agent.graded_moves()
-                            print(end_moves)
-                            rotation = 0
-
-                        while rotation < 4 and (rotation not in end_moves or not end_moves[rotation]):
-                            rotation += 1
-
-                        if rotation < 4:
-                            x, y, grade = end_moves[rotation].pop(0)
-                            print(f"({rotation}) {x}, {y} : {grade}")
-                            self.game_agent.cur_piece = np.array(self.game_agent.pieces[self.game_agent.cur_piece_index])
-                            for _ in range(rotation):
-                                self.game_agent.cur_piece = np.rot90(self.game_agent.cur_piece, -1)
-                        else:
-                            print("Finished all possible moves")
-                            end_moves = None
-                            x, y = None, None
-
-                            self.game_agent.agent_random_move()
-                    else:
-                        if self.ai:
-                            action = self.tetris_network.pick_move()
-
-                            self.game_agent.do_move(action["x"], action["y"], action["rot"])
-                        else:
-                            self.game_agent.agent_random_move()
-
-            self.draw_game()
-            if self.DEBUG and x is not None:
-                self.game_agent._insert_piece(x, y)
-                self.draw_game()
-                self.game_agent._remove_piece(x, y)
-
-            self.draw_text()
-            pygame.display.flip()
-            self.clock.tick(60)
+                # the agent thinks on the worker, a tick while it is still busy is skipped
+                if event.type == AGENTEVENT and not self.worker.busy:
+                    self._think()
+                if event.type == THOUGHTEVENT:
+                    self._thought(event)
+
+            if self.debug_piece is not None:
+                self.game_agent._insert_piece(*self.debug_piece)
+                dirty = self.draw_game()
+                self.game_agent._remove_piece(*self.debug_piece)
+            else:
+                dirty = self.draw_game()
+
+            if dirty:
+                pygame.display.update(dirty)
+            if not self.fast_forward: # there every move is drawn as soon as it is made
+                self.clock.tick(60)
 
+        self.worker.close()
         pygame.quit()
 